@@ -0,0 +1,98 @@
+# analysis_job.py
+# Análisis de un CSV (o de varios, ver cohort_ingest.py) como trabajo en
+# segundo plano, cancelable y con progreso.
+# El hilo del trabajo no toca Tk: deja sus mensajes en 'cola' (queue.Queue)
+# y la GUI la vacía periódicamente con 'root.after':
+#   ('progreso', ProgresoAnalisis)   tras cada bloque analizado
+#   ('fin', results_df, error)       una sola vez, al terminar o cancelar
+
+import os
+import queue
+import threading
+
+from logic_engine import analizar_csv_por_bloques, CacheDiplotipos, DestinoMemoria, TAMANO_BLOQUE_DEFECTO
+from cohort_ingest import analizar_cohorte
+
+
+class TrabajoAnalisis:
+    """
+    Ejecuta 'analizar_csv_por_bloques' en un hilo. 'cancelar()' detiene el
+    análisis antes del siguiente bloque; los bloques ya analizados se
+    descartan y el trabajo termina con el error ANALISIS_CANCELADO.
+    Si 'ruta_csv' es una carpeta o una lista de rutas, la cohorte se carga
+    con 'analizar_cohorte' y el progreso se notifica por archivo.
+    """
+
+    def __init__(self, ruta_csv, cyp2d6_phenotype_map, cache_resultados=None, nombre_cohorte=None,
+                 tamano_bloque=TAMANO_BLOQUE_DEFECTO):
+        self.ruta_csv = ruta_csv
+        self.cyp2d6_phenotype_map = cyp2d6_phenotype_map
+        self.cache_resultados = cache_resultados
+        self.nombre_cohorte = nombre_cohorte
+        self.tamano_bloque = tamano_bloque
+        self.cola = queue.Queue()
+        self._cancelar = threading.Event()
+        self._hilo = threading.Thread(target=self._ejecutar, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+        return self
+
+    def cancelar(self):
+        self._cancelar.set()
+
+    @property
+    def cancelado(self):
+        return self._cancelar.is_set()
+
+    def _ejecutar(self):
+        if isinstance(self.ruta_csv, (list, tuple)) or os.path.isdir(self.ruta_csv):
+            self._ejecutar_cohorte()
+        else:
+            self._ejecutar_bloques()
+
+    def _ejecutar_cohorte(self):
+        try:
+            results_df, _, error = analizar_cohorte(
+                self.ruta_csv, self.cyp2d6_phenotype_map, cache_resultados=self.cache_resultados,
+                nombre_cohorte=self.nombre_cohorte, progreso=lambda progreso: self.cola.put(('progreso', progreso)),
+                cancelar=self._cancelar
+            )
+        except Exception as e:
+            results_df, error = None, f"Error al cargar la cohorte: {e}"
+        if not error and self.cache_resultados is not None:
+            results_df.attrs['cache_resultados'] = self.cache_resultados.resumen()
+        self.cola.put(('fin', results_df, error))
+
+    def _ejecutar_bloques(self):
+        results_sink = DestinoMemoria()
+        diplotype_cache = CacheDiplotipos()
+        results_df = None
+        grabando_cohorte = self.cache_resultados is not None and bool(self.nombre_cohorte)
+        try:
+            try:
+                if grabando_cohorte:
+                    self.cache_resultados.iniciar_cohorte(self.nombre_cohorte, self.cyp2d6_phenotype_map)
+                _, error = analizar_csv_por_bloques(
+                    self.ruta_csv, self.cyp2d6_phenotype_map, results_sink, tamano_bloque=self.tamano_bloque,
+                    cache_diplotipos=diplotype_cache, cache_resultados=self.cache_resultados,
+                    progreso=lambda progreso: self.cola.put(('progreso', progreso)), cancelar=self._cancelar
+                )
+                if not error and grabando_cohorte:
+                    self.cache_resultados.finalizar_cohorte()
+                    grabando_cohorte = False
+            finally:
+                # Fallo o cancelación: se conserva la cohorte guardada anterior
+                if grabando_cohorte:
+                    self.cache_resultados.descartar_cohorte()
+        except Exception as e:
+            error = f"Error en la caché de resultados: {e}"
+        if not error:
+            results_df = results_sink.resultado()
+            results_df.attrs['cache_diplotipos'] = diplotype_cache.resumen()
+            if self.cache_resultados is not None:
+                results_df.attrs['cache_resultados'] = self.cache_resultados.resumen()
+        # Libera los bloques parciales (o ya unidos) antes de avisar a la GUI
+        results_sink.bloques.clear()
+        del results_sink
+        self.cola.put(('fin', results_df, error))
@@ -0,0 +1,524 @@
+# batch_reports.py
+# Generación de informes en lote, en serie o repartida en un pool de procesos.
+# Los PDFs se renderizan en memoria y los escriben hilos de E/S dedicados
+# (ver 'EscritorDiferido'), así que maquetación y escritura se solapan.
+# No importa tkinter: los procesos hijos solo cargan el motor y el generador de PDF.
+
+import io
+import os
+import json
+import time
+import queue
+import threading
+import hashlib
+import logging
+import sqlite3
+import tarfile
+import zipfile
+from datetime import datetime
+from functools import partial
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from logic_engine import get_recommendations
+from pdf_generator import render_pdf_report, create_pdf_bundle, TEMPLATE_VERSION
+from instrumentation import PERFIL, medir
+
+INDEX_FILENAME = "indice_informes.json"
+FINGERPRINTS_FILENAME = "huellas_informes.sqlite3"
+MANIFEST_FILENAME = "manifiesto_informes.json"
+# Formatos de archivo admitidos: extensión -> modo de 'tarfile.open' (None = ZIP)
+FORMATOS_ARCHIVO = {'.zip': None, '.tar': 'w', '.tar.gz': 'w:gz', '.tgz': 'w:gz'}
+# Hilos que escriben los PDFs en la carpeta y PDFs renderizados que pueden
+# esperar en la cola antes de que la maquetación tenga que detenerse
+HILOS_ESCRITURA = 2
+CAPACIDAD_ESCRITURA = 64
+
+
+def preparar_tareas(results_df, patient_db, output_folder):
+    """
+    Convierte cada fila de 'results_df' en una tarea serializable
+    (patient_id, patient_info, genotypes, phenotypes, output_folder, huella).
+    'huella' es None salvo en modo incremental (ver '_omitir_al_dia') y
+    vuelve en el resultado de la tarea, así que cada fila anota la suya
+    aunque haya IDs repetidos.
+    """
+    for patient_id, row in results_df.iterrows():
+        genotypes = {
+            'DPYD': row['DPYD'],
+            'CYP2D6': row['CYP2D6'],
+            'UGT1A1': row['UGT1A1']
+        }
+        phenotypes = {
+            'DPYD': row['Fenotipo_DPYD'],
+            'CYP2D6': row['Fenotipo_CYP2D6'],
+            'UGT1A1': row['Fenotipo_UGT1A1']
+        }
+        patient_info = patient_db.get(patient_id, {"N° Historia": patient_id})
+        yield patient_id, patient_info, genotypes, phenotypes, output_folder, None
+
+
+def renderizar_informe(tarea):
+    """
+    Renderiza en memoria el PDF de una tarea; lo escribe después un
+    'EscritorDiferido'. Se ejecuta tanto en el hilo del lote como en los
+    procesos del pool, así que nunca lanza excepciones: devuelve
+    (resultado, pdf_bytes), con resultado = (patient_id, error, es_critico,
+    filename sin carpeta, huella).
+    """
+    patient_id, patient_info, genotypes, phenotypes, _, huella = tarea
+    try:
+        recommendations = get_recommendations(phenotypes)
+        filename, data, error = render_pdf_report(patient_info, genotypes, phenotypes, recommendations)
+        return (patient_id, error, False, filename, huella), data
+    except Exception as e:
+        return (patient_id, str(e), True, None, huella), None
+
+
+def generar_paquete(paquete):
+    """
+    Genera un PDF con varios pacientes seguidos (modo paquete).
+    'paquete' es (numero, tareas). Devuelve (nombre_archivo, resultados, paginas),
+    con un resultado (patient_id, error, es_critico, filename, huella) por tarea y las páginas
+    (patient_id, primera, última) de cada informe generado.
+    """
+    numero, tareas = paquete
+    output_folder = tareas[0][4]
+    filename = os.path.join(output_folder, f"Informes_PGx_{numero:04d}_{datetime.now().strftime('%Y%m%d')}.pdf")
+    reports = (
+        (patient_info, genotypes, phenotypes, get_recommendations(phenotypes))
+        for _, patient_info, genotypes, phenotypes, _, _ in tareas
+    )
+    indice, error = create_pdf_bundle(reports, filename)
+    if error:
+        return filename, [(tarea[0], error, True, None, tarea[5]) for tarea in tareas], []
+    resultados, paginas = [], []
+    for tarea, entrada in zip(tareas, indice):
+        resultados.append((tarea[0], entrada.get("error"), False, filename, tarea[5]))
+        if "error" not in entrada:
+            paginas.append((tarea[0], entrada["first_page"], entrada["last_page"]))
+    return filename, resultados, paginas
+
+
+def huella_informe(patient_info, genotypes, phenotypes, recommendations):
+    """
+    sha256 de todo lo que determina el contenido de un informe: datos del
+    paciente, genotipos, fenotipos, recomendaciones y TEMPLATE_VERSION.
+    """
+    texto = json.dumps(
+        [TEMPLATE_VERSION, patient_info, genotypes, phenotypes, recommendations],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+class HuellasInformes:
+    """
+    Registro, dentro de la carpeta de salida, de la huella de entradas y del
+    archivo de cada informe generado. En modo incremental un informe se omite
+    si su huella no ha cambiado y su archivo sigue en la carpeta.
+    """
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        os.makedirs(output_folder, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(output_folder, FINGERPRINTS_FILENAME))
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS informes (id TEXT PRIMARY KEY, huella TEXT NOT NULL, archivo TEXT NOT NULL)"
+            )
+        self._registrados = dict(
+            (patient_id, (huella, archivo))
+            for patient_id, huella, archivo in self._conn.execute("SELECT id, huella, archivo FROM informes")
+        )
+        # Un solo listado de la carpeta en lugar de un 'os.path.exists' por paciente
+        self._archivos = set(os.listdir(output_folder))
+        self._pendientes = []
+
+    def al_dia(self, patient_id, huella):
+        registrado = self._registrados.get(patient_id)
+        return registrado is not None and registrado[0] == huella and registrado[1] in self._archivos
+
+    def anotar(self, patient_id, huella, filename):
+        self._pendientes.append((patient_id, huella, os.path.basename(filename)))
+        if len(self._pendientes) >= 1000:
+            self.guardar()
+
+    def guardar(self):
+        """Escribe las huellas anotadas; si el lote se interrumpe, lo ya generado no se repite."""
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO informes VALUES (?, ?, ?)", self._pendientes)
+        self._pendientes = []
+
+    def cerrar(self):
+        self.guardar()
+        self._conn.close()
+
+
+def ruta_archivo_lote(output_folder, formato='.zip'):
+    """Ruta por defecto del archivo de un lote: 'Informes_PGx_<fecha><formato>' dentro de 'output_folder'."""
+    return os.path.join(output_folder, f"Informes_PGx_{datetime.now().strftime('%Y%m%d')}{formato}")
+
+
+def nombre_sin_repetir(nombre, usados, extension=''):
+    """
+    Devuelve 'nombre' o, si ya está en 'usados', 'nombre_2', 'nombre_3'...
+    (antes de 'extension'), y lo añade a 'usados'. Evita que un ID de
+    muestra repetido pise el informe o la entrada del índice del primero.
+    """
+    base = nombre[:-len(extension)] if extension and nombre.endswith(extension) else nombre
+    candidato, numero = nombre, 1
+    while candidato in usados:
+        numero += 1
+        candidato = f"{base}_{numero}{extension}"
+    usados.add(candidato)
+    return candidato
+
+
+def formato_archivo(ruta):
+    """Extensión de FORMATOS_ARCHIVO con la que termina 'ruta' (ValueError si no es ninguna)."""
+    for extension in sorted(FORMATOS_ARCHIVO, key=len, reverse=True):
+        if ruta.lower().endswith(extension):
+            return extension
+    raise ValueError(f"Formato de archivo no admitido: '{os.path.basename(ruta)}' (use {', '.join(FORMATOS_ARCHIVO)})")
+
+
+class ArchivoInformes:
+    """
+    Único escritor de un archivo ZIP o TAR de informes. Los PDFs llegan ya
+    renderizados en memoria y se añaden uno tras otro, sin crear un archivo
+    por paciente. Al cerrar se añade MANIFEST_FILENAME con el paciente, el
+    nombre y el sha256 de cada PDF, y el archivo temporal se renombra al
+    definitivo, así que un lote interrumpido no deja un archivo a medias.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._modo_tar = FORMATOS_ARCHIVO[formato_archivo(ruta)]
+        carpeta = os.path.dirname(ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        self._ruta_temporal = ruta + '.tmp'
+        if self._modo_tar is None:
+            # Sin compresión: los PDF ya van comprimidos por página
+            self._archivo = zipfile.ZipFile(self._ruta_temporal, 'w', compression=zipfile.ZIP_STORED)
+        else:
+            self._archivo = tarfile.open(self._ruta_temporal, self._modo_tar)
+        self.manifiesto = []
+        self._nombres = {MANIFEST_FILENAME}
+
+    def _escribir(self, nombre, data):
+        if self._modo_tar is None:
+            self._archivo.writestr(zipfile.ZipInfo(nombre, date_time=time.localtime()[:6]), data)
+        else:
+            info = tarfile.TarInfo(nombre)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._archivo.addfile(info, io.BytesIO(data))
+
+    def anadir(self, patient_id, filename, data):
+        """Añade un PDF; con IDs repetidos el nombre lleva un sufijo '_2', '_3'... Devuelve el nombre usado."""
+        filename = nombre_sin_repetir(filename, self._nombres, '.pdf')
+        with medir('lote.archivo', filas=1) as medicion:
+            self._escribir(filename, data)
+            medicion.bytes = len(data)
+        self.manifiesto.append({
+            "patient_id": patient_id, "archivo": filename,
+            "sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data),
+        })
+        return filename
+
+    def cerrar(self):
+        manifiesto = json.dumps(self.manifiesto, indent=4, ensure_ascii=False, default=str)
+        self._escribir(MANIFEST_FILENAME, manifiesto.encode('utf-8'))
+        self._archivo.close()
+        os.replace(self._ruta_temporal, self.ruta)
+
+    def descartar(self):
+        self._archivo.close()
+        os.remove(self._ruta_temporal)
+
+
+def _escribir_pdf(output_folder, patient_id, filename, data):
+    """Escribe un PDF ya renderizado en la carpeta del lote (creada antes, una sola vez)."""
+    ruta = os.path.join(output_folder, filename)
+    with medir('pdf.guardado', filas=1) as medicion:
+        with open(ruta, 'wb') as f:
+            f.write(data)
+        medicion.bytes = len(data)
+    return ruta
+
+
+class EscritorDiferido:
+    """
+    Escritura en segundo plano de PDFs ya renderizados. 'enviar' deja el PDF
+    en una cola de 'capacidad' elementos y vuelve enseguida; si la cola está
+    llena espera, así que la maquetación nunca se adelanta más de 'capacidad'
+    PDFs al disco. 'hilos' hilos llaman a 'escribir(patient_id, filename,
+    data)', que devuelve la ruta final. Los resultados (los de
+    'renderizar_informe', con la ruta final o el error de escritura) se
+    recogen en el hilo del lote con 'terminados()' y 'cerrar()', para que el
+    recuento y las huellas no salgan de ese hilo.
+    """
+
+    def __init__(self, escribir, hilos=HILOS_ESCRITURA, capacidad=CAPACIDAD_ESCRITURA):
+        self._escribir = escribir
+        self._cola = queue.Queue(maxsize=capacidad)
+        self._terminados = queue.Queue()
+        self.errores = []
+        self._hilos = [
+            threading.Thread(target=self._trabajar, name=f"escritor-informes-{i}", daemon=True)
+            for i in range(max(1, hilos))
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def enviar(self, resultado, data):
+        with medir('lote.espera_escritura'):
+            self._cola.put((resultado, data))
+
+    def _trabajar(self):
+        while True:
+            elemento = self._cola.get()
+            if elemento is None:
+                return
+            (patient_id, _, _, filename, huella), data = elemento
+            try:
+                resultado = (patient_id, None, False, self._escribir(patient_id, filename, data), huella)
+            except Exception as e:
+                self.errores.append(str(e))
+                resultado = (patient_id, str(e), False, None, huella)
+            self._terminados.put(resultado)
+
+    def terminados(self):
+        """Resultados de las escrituras acabadas desde la última llamada, sin esperar."""
+        while True:
+            try:
+                yield self._terminados.get_nowait()
+            except queue.Empty:
+                return
+
+    def cerrar(self):
+        """Espera a que se escriba todo lo enviado y devuelve los resultados pendientes."""
+        for _ in self._hilos:
+            self._cola.put(None)
+        for hilo in self._hilos:
+            hilo.join()
+        return list(self.terminados())
+
+
+def _iniciar_trabajador(perfil_activo):
+    """Inicializador de los procesos del pool: hereda el estado del perfil, pero no sus medidas."""
+    PERFIL.activar(perfil_activo)
+    PERFIL.reiniciar()  # Con 'fork' el hijo copiaría las medidas ya acumuladas por el padre
+
+
+def _en_trabajador(funcion, lote):
+    """Ejecuta 'funcion' sobre un lote de argumentos en un proceso del pool y devuelve también sus medidas del perfil."""
+    resultados = [funcion(argumento) for argumento in lote]
+    return resultados, PERFIL.instantanea(reiniciar=True) if PERFIL.activo else None
+
+
+def _map_en_pool(funcion, argumentos, procesos, chunksize=1, lotes_en_vuelo=None):
+    """
+    Como 'executor.map' (mismo orden), sumando al perfil local las medidas de
+    cada proceso. A diferencia de 'executor.map', que envía todos los lotes
+    de golpe, solo hay 'lotes_en_vuelo' lotes enviados a la vez (por defecto,
+    dos por proceso): se envía uno nuevo cada vez que se recoge otro. Si quien
+    consume los resultados se detiene (ej: 'EscritorDiferido' con la cola
+    llena), el pool se detiene también y los resultados no se acumulan.
+    """
+    lotes_en_vuelo = lotes_en_vuelo or 2 * procesos
+    argumentos = iter(argumentos)
+    executor = ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador, initargs=(PERFIL.activo,))
+    pendientes = deque()
+
+    def enviar_lote():
+        lote = list(islice(argumentos, chunksize))
+        if lote:
+            pendientes.append(executor.submit(_en_trabajador, funcion, lote))
+        return bool(lote)
+
+    try:
+        while len(pendientes) < lotes_en_vuelo and enviar_lote():
+            pass
+        while pendientes:
+            resultados, medidas = pendientes.popleft().result()
+            enviar_lote()
+            if medidas:
+                PERFIL.fusionar(medidas)
+            yield from resultados
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _agrupar(tareas, tamano):
+    numero = 1
+    tareas = iter(tareas)
+    while True:
+        grupo = list(islice(tareas, tamano))
+        if not grupo:
+            return
+        yield numero, grupo
+        numero += 1
+
+
+def _omitir_al_dia(tareas, huellas, omitir):
+    """Deja pasar solo las tareas cuyo informe falta o ha cambiado, ya con su huella."""
+    for tarea in tareas:
+        patient_id, patient_info, genotypes, phenotypes, output_folder, _ = tarea
+        with medir('lote.huella', filas=1):
+            huella = huella_informe(patient_info, genotypes, phenotypes, get_recommendations(phenotypes))
+            al_dia = huellas.al_dia(patient_id, huella)
+        if al_dia:
+            omitir(patient_id)
+        else:
+            yield patient_id, patient_info, genotypes, phenotypes, output_folder, huella
+
+
+def generar_informes_lote(results_df, patient_db, output_folder="Informes_Lote", procesos=1, tamano_lote=None, progreso=None,
+                          pacientes_por_archivo=None, incremental=False, archivo=None):
+    """
+    Genera un informe por paciente de 'results_df'.
+    Con 'procesos' > 1 reparte las tareas en un ProcessPoolExecutor en lotes
+    de 'tamano_lote' pacientes. Los PDFs se renderizan en memoria y los
+    escriben hilos de E/S (ver 'EscritorDiferido'); 'progreso(1)' se llama
+    una vez por paciente, cuando su PDF queda escrito o falla.
+    Con 'pacientes_por_archivo' (modo paquete) los informes se agrupan en PDFs
+    de ese número de pacientes (0 = uno solo) y se escribe 'indice_informes.json'
+    con el archivo y las páginas de cada paciente.
+    Con 'incremental' (solo un PDF por paciente) se omiten los informes cuya
+    huella de entradas coincide con la de 'huellas_informes.sqlite3' y cuyo
+    archivo sigue en la carpeta (ver 'HuellasInformes').
+    Con 'archivo' (ruta de un .zip, .tar o .tar.gz; ver 'ruta_archivo_lote')
+    los PDFs se generan en memoria y este proceso los añade a ese único
+    archivo junto con su manifiesto (ver 'ArchivoInformes'), en lugar de
+    escribir un archivo por paciente; no se combina con paquetes ni con
+    'incremental'.
+    Devuelve (success_count, fail_count, skip_count); los fallos se registran con logging.
+    """
+    success_count, fail_count, skip_count = 0, 0, 0
+    tareas = preparar_tareas(results_df, patient_db, output_folder)
+
+    huellas = None
+    if incremental and pacientes_por_archivo is None and archivo is None:
+        huellas = HuellasInformes(output_folder)
+
+        def omitir(patient_id):
+            nonlocal skip_count
+            skip_count += 1
+            if progreso:
+                progreso(1)
+
+        tareas = _omitir_al_dia(tareas, huellas, omitir)
+
+    def contabilizar(resultado):
+        nonlocal success_count, fail_count
+        patient_id, error, es_critico, filename, huella = resultado
+        if error is None:
+            success_count += 1
+            if huellas is not None and huella is not None:
+                huellas.anotar(patient_id, huella, filename)
+        elif es_critico:
+            fail_count += 1
+            logging.error(f"Fallo crítico al procesar paciente {patient_id}: {error}")
+        else:
+            fail_count += 1
+            logging.error(f"Fallo al generar PDF para {patient_id}: {error}")
+        if progreso:
+            progreso(1)
+
+    procesos = max(1, procesos or os.cpu_count() or 1)
+    if archivo is not None:
+        _generar_archivo_lote(results_df, tareas, archivo, procesos, tamano_lote, contabilizar)
+        return success_count, fail_count, skip_count
+    if pacientes_por_archivo is not None:
+        _generar_paquetes_lote(
+            results_df, tareas, output_folder, procesos, pacientes_por_archivo or len(results_df) or 1, contabilizar
+        )
+        return success_count, fail_count, skip_count
+
+    os.makedirs(output_folder, exist_ok=True)  # Una sola vez por lote, no por paciente
+    escritor = EscritorDiferido(partial(_escribir_pdf, output_folder))
+    try:
+        try:
+            _renderizar_y_escribir(results_df, tareas, procesos, tamano_lote, escritor, contabilizar)
+        finally:
+            for resultado in escritor.cerrar():
+                contabilizar(resultado)
+    finally:
+        if huellas is not None:
+            huellas.cerrar()
+    return success_count, fail_count, skip_count
+
+
+def _tamano_lote_defecto(n_pacientes, procesos):
+    # Lotes suficientemente grandes para amortizar el envío entre procesos,
+    # pero con varios lotes por proceso para repartir bien la carga.
+    return max(1, min(64, n_pacientes // (procesos * 4)))
+
+
+def _renderizar_y_escribir(results_df, tareas, procesos, tamano_lote, escritor, contabilizar):
+    """Renderiza las tareas (en serie o en el pool) y envía cada PDF a 'escritor' mientras se maqueta el siguiente."""
+    if procesos == 1 or len(results_df) <= 1:
+        resultados = map(renderizar_informe, tareas)
+    else:
+        tamano_lote = tamano_lote or _tamano_lote_defecto(len(results_df), procesos)
+        resultados = _map_en_pool(renderizar_informe, tareas, procesos, chunksize=tamano_lote)
+    for resultado, data in resultados:
+        if resultado[1] is None:
+            escritor.enviar(resultado, data)
+        else:
+            contabilizar(resultado)
+        for resultado in escritor.terminados():
+            contabilizar(resultado)
+
+
+def _generar_archivo_lote(results_df, tareas, ruta_archivo, procesos, tamano_lote, contabilizar):
+    """
+    Modo archivo de 'generar_informes_lote': se renderiza como en el modo
+    normal y un único hilo de escritura añade los PDFs al archivo. Un error
+    de escritura invalida el archivo entero.
+    """
+    archivo = ArchivoInformes(ruta_archivo)
+    escritor = EscritorDiferido(archivo.anadir, hilos=1)
+    try:
+        try:
+            _renderizar_y_escribir(results_df, tareas, procesos, tamano_lote, escritor, contabilizar)
+        finally:
+            for resultado in escritor.cerrar():
+                contabilizar(resultado)
+    except BaseException:
+        archivo.descartar()
+        raise
+    if escritor.errores:
+        archivo.descartar()
+        raise OSError(f"No se pudo escribir '{ruta_archivo}': {escritor.errores[0]}")
+    archivo.cerrar()
+
+
+def _generar_paquetes_lote(results_df, tareas, output_folder, procesos, pacientes_por_archivo, contabilizar):
+    """Modo paquete de 'generar_informes_lote': cada proceso genera PDFs completos de varios pacientes."""
+    indice_global = {}  # Un ID repetido se guarda como 'ID_2', 'ID_3'... (ver 'nombre_sin_repetir')
+    claves_indice = set()
+    paquetes = _agrupar(tareas, pacientes_por_archivo)
+
+    def recoger(resultado_paquete):
+        filename, resultados, paginas = resultado_paquete
+        for resultado in resultados:
+            contabilizar(resultado)
+        for patient_id, first_page, last_page in paginas:
+            indice_global[nombre_sin_repetir(str(patient_id), claves_indice)] = {"archivo": os.path.basename(filename), "paginas": [first_page, last_page]}
+
+    n_paquetes = -(-len(results_df) // pacientes_por_archivo)
+    if procesos == 1 or n_paquetes <= 1:
+        for paquete in paquetes:
+            recoger(generar_paquete(paquete))
+    else:
+        for resultado_paquete in _map_en_pool(generar_paquete, paquetes, procesos):
+            recoger(resultado_paquete)
+
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, INDEX_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(indice_global, f, indent=4, ensure_ascii=False)
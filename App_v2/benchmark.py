@@ -0,0 +1,205 @@
+# benchmark.py
+# Banco de pruebas de rendimiento con generador de cohortes sintéticas.
+#   python benchmark.py --muestras 1000 100000 --salida resultados.json
+#   python benchmark.py --generar cohorte.csv --muestras 1000000
+# Mide por separado cada etapa del pipeline y devuelve un JSON con el tiempo,
+# el rendimiento (elementos/s) y el pico de memoria (tracemalloc) de cada una.
+
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import logic_engine
+from logic_engine import (
+    cargar_reglas, cargar_mapa_cyp2d6, mapear_nts_a_alelos_vectorizado, CacheDiplotipos,
+    fenotipar_cyp2d6, get_recommendations, run_full_analysis, GENES_ANALIZADOS
+)
+from pdf_generator import create_pdf_report
+
+# Frecuencia (aproximada, población europea) del alelo variante de cada SNP.
+# Las columnas que no aparecen usan FRECUENCIA_POR_DEFECTO.
+FRECUENCIAS_VARIANTE = {
+    'DPYD_2A': 0.01, 'DPYD_13': 0.001, 'DPYD_D949V': 0.007, 'DPYD_HapB3': 0.02,
+    'UGT1A1_80': 0.30,
+    'CYP2D6_3': 0.015, 'CYP2D6_6': 0.01, 'CYP2D6_9': 0.02, 'CYP2D6_10': 0.02,
+    'CYP2D6_17': 0.005, 'CYP2D6_29': 0.005, 'CYP2D6_41': 0.09,
+}
+FRECUENCIA_POR_DEFECTO = 0.003
+
+# Haplotipos CYP2D6 que marcan varios SNPs a la vez. El *4 arrastra la
+# variante de *10 y la de *10*4, que es lo que ejercita la lógica de
+# prioridades de 'combinar_gen'.
+HAPLOTIPOS_LIGADOS = {
+    '*4': (0.18, ['CYP2D6_4', 'CYP2D6_10_4', 'CYP2D6_10']),
+}
+TASA_UND = 0.01
+
+
+def nombre_columna_csv(columna_regla):
+    """'CYP2D6_10_4' -> 'CYP2D6*10*4', 'DPYD_HapB3' -> 'DPYD_HapB3' (como en genotipo.csv)."""
+    return re.sub(r'_(?=\d)', '*', columna_regla)
+
+
+def generar_cohorte(n_muestras, ruta_csv, semilla=0, reglas=None):
+    """
+    Escribe un CSV 'Sample/Assay' sintético con las columnas de 'reglas_alelos.json'.
+    Cada muestra tiene dos cromosomas: los SNPs se sortean con las frecuencias de
+    FRECUENCIAS_VARIANTE, los haplotipos de HAPLOTIPOS_LIGADOS marcan varios SNPs
+    a la vez y un TASA_UND de las llamadas sale como 'UND'.
+    """
+    if reglas is None:
+        reglas = cargar_reglas()
+    rng = np.random.default_rng(semilla)
+    columnas = list(reglas.mapa)
+
+    # variante[c] -> matriz (n_muestras, 2) de booleanos, un valor por cromosoma
+    variante = {
+        c: rng.random((n_muestras, 2)) < FRECUENCIAS_VARIANTE.get(c, FRECUENCIA_POR_DEFECTO)
+        for c in columnas
+    }
+    for frecuencia, columnas_ligadas in HAPLOTIPOS_LIGADOS.values():
+        portador = rng.random((n_muestras, 2)) < frecuencia
+        for c in columnas_ligadas:
+            if c in variante:
+                variante[c] |= portador
+
+    datos = {'Sample/Assay': [f"S{i:07d}" for i in range(n_muestras)]}
+    for c in columnas:
+        referencia = [nt for nt, alelo in reglas.mapa[c].items() if alelo == '*1']
+        alternativos = [nt for nt, alelo in reglas.mapa[c].items() if alelo != '*1']
+        ref = referencia[0] if referencia else 'N'
+        alt = alternativos[0] if alternativos else ref
+        # Códigos: 0 = ref/ref, 1 = ref/alt, 2 = alt/alt, 3 = UND
+        llamadas = np.array([f"{ref}/{ref}", f"{ref}/{alt}", f"{alt}/{alt}", "UND"], dtype=object)
+        codigos = variante[c].sum(axis=1)
+        codigos[rng.random(n_muestras) < TASA_UND] = 3
+        datos[nombre_columna_csv(c)] = llamadas[codigos]
+
+    pd.DataFrame(datos).to_csv(ruta_csv, sep=';', index=False)
+    return ruta_csv
+
+
+class Benchmark:
+    """Ejecuta y anota las etapas: primero cronometradas y, si 'memoria', otra vez bajo tracemalloc."""
+
+    def __init__(self, memoria=True):
+        self.memoria = memoria
+        self.etapas = []
+
+    def medir(self, etapa, n_elementos, funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        segundos = time.perf_counter() - inicio
+
+        pico = None
+        if self.memoria:
+            tracemalloc.start()
+            funcion(*args)
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        self.etapas.append({
+            'etapa': etapa,
+            'elementos': n_elementos,
+            'segundos': round(segundos, 6),
+            'elementos_por_segundo': round(n_elementos / segundos, 1) if segundos else None,
+            'pico_memoria_bytes': pico,
+        })
+        return resultado
+
+
+def ejecutar(n_muestras, carpeta, memoria=True, informes_pdf=200, semilla=0):
+    """Genera una cohorte de 'n_muestras' y mide cada etapa. Devuelve la lista de medidas."""
+    reglas = cargar_reglas()
+    mapa_cyp2d6 = cargar_mapa_cyp2d6()
+    ruta_csv = generar_cohorte(n_muestras, os.path.join(carpeta, f"cohorte_{n_muestras}.csv"), semilla, reglas)
+    df_raw = pd.read_csv(ruta_csv, sep=';', dtype={'Sample/Assay': str}).set_index('Sample/Assay')
+    df_limpio = df_raw.set_axis(reglas.nombres_limpios(df_raw.columns), axis=1)
+    columnas_por_gen = reglas.columnas_por_gen(df_limpio.columns)
+    bench = Benchmark(memoria)
+
+    df_alelos = bench.medir(
+        'mapear_nts_a_alelos', n_muestras * df_limpio.shape[1],
+        lambda: df_limpio.apply(lambda columna: mapear_nts_a_alelos_vectorizado(columna, reglas.mapa))
+    )
+
+    def combinar():
+        cache = CacheDiplotipos()
+        return {gen: cache.combinar(df_alelos[columnas_por_gen[gen]], gen) for gen in GENES_ANALIZADOS}
+    diplotipos = bench.medir('combinar_gen', n_muestras * len(GENES_ANALIZADOS), combinar)
+
+    fenotipos_cyp2d6 = bench.medir(
+        'fenotipo_cyp2d6', n_muestras,
+        lambda: fenotipar_cyp2d6(diplotipos['CYP2D6'], mapa_cyp2d6)
+    )
+
+    fenotipos = [
+        {'DPYD': logic_engine.fenotipo_dpyd(d), 'CYP2D6': c, 'UGT1A1': logic_engine.fenotipo_ugt1a1(u)}
+        for d, c, u in zip(diplotipos['DPYD'], fenotipos_cyp2d6, diplotipos['UGT1A1'])
+    ]
+    bench.medir('get_recommendations', n_muestras, lambda: [get_recommendations(f) for f in fenotipos])
+
+    bench.medir('run_full_analysis', n_muestras, run_full_analysis, df_raw, mapa_cyp2d6)
+
+    n_pdf = min(informes_pdf, n_muestras)
+    carpeta_pdf = os.path.join(carpeta, "informes")
+
+    def generar_pdfs():
+        for patient_id, f, d, c, u in zip(df_raw.index[:n_pdf], fenotipos, diplotipos['DPYD'], diplotipos['CYP2D6'], diplotipos['UGT1A1']):
+            create_pdf_report({"N° Historia": patient_id}, {'DPYD': d, 'CYP2D6': c, 'UGT1A1': u}, f, get_recommendations(f), folder=carpeta_pdf)
+    if n_pdf:
+        bench.medir('create_pdf_report', n_pdf, generar_pdfs)
+
+    return bench.etapas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de análisis e informes.")
+    parser.add_argument("--muestras", type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Tamaños de cohorte a medir (1k-1M).")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto, se imprime).")
+    parser.add_argument("--pdf", type=int, default=200, help="Informes PDF a generar por cohorte (0 = ninguno).")
+    parser.add_argument("--sin-memoria", action="store_true", help="No mide el pico de memoria (evita la segunda pasada).")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--generar", metavar="CSV", help="Solo genera una cohorte (del primer tamaño de --muestras) en este CSV.")
+    args = parser.parse_args(argv)
+
+    if args.generar:
+        generar_cohorte(args.muestras[0], args.generar, args.semilla)
+        return 0
+
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'cohortes': [],
+    }
+    with tempfile.TemporaryDirectory() as carpeta:
+        for n_muestras in args.muestras:
+            etapas = ejecutar(n_muestras, carpeta, not args.sin_memoria, args.pdf, args.semilla)
+            informe['cohortes'].append({'muestras': n_muestras, 'etapas': etapas})
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# cohort_ingest.py
+# Carga de una cohorte repartida en varios CSV (uno por placa de genotipado):
+#   results_df, duplicados, error = analizar_cohorte("carpeta_placas/", mapa_cyp2d6)
+# Cada archivo se lee en un hilo (la lectura es sobre todo E/S) y sus
+# muestras se analizan con 'run_full_analysis' en un pool de procesos, así
+# que la cohorte completa tarda aproximadamente lo que el archivo más lento.
+# Los resultados se unen en el orden de los archivos. Una muestra que aparece
+# en varios archivos se queda con los resultados del primero y se informa en
+# 'duplicados' ({ID: [archivos]}), también guardado en results_df.attrs.
+
+import os
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from logic_engine import (
+    run_full_analysis, CacheDiplotipos, ProgresoAnalisis, ANALISIS_CANCELADO, compactar_resultados,
+    concatenar_resultados, COLUMNAS_RESULTADOS
+)
+from instrumentation import PERFIL, medir
+
+MAX_HILOS = 32
+
+# Estado de cada proceso del pool (ver '_iniciar_trabajador')
+_mapa_trabajador = None
+_cache_trabajador = None
+
+
+def listar_csv(origen):
+    """Rutas de los CSV a cargar: los '*.csv' de una carpeta (por nombre) o la lista de rutas tal cual."""
+    if isinstance(origen, (str, os.PathLike)):
+        if os.path.isdir(origen):
+            nombres = sorted(n for n in os.listdir(origen) if n.lower().endswith('.csv'))
+            return [os.path.join(origen, nombre) for nombre in nombres]
+        return [os.fspath(origen)]
+    return [os.fspath(ruta) for ruta in origen]
+
+
+def leer_genotipos(ruta_csv):
+    """Lee un CSV de genotipado completo, limpio e indexado por muestra (como 'leer_genotipos_por_bloques')."""
+    df = pd.read_csv(ruta_csv, sep=';', dtype={'Sample/Assay': str})
+    if 'Sample/Assay' not in df.columns:
+        raise ValueError("El archivo CSV no contiene la columna 'Sample/Assay'.")
+    return df.dropna(subset=['Sample/Assay']).set_index('Sample/Assay')
+
+
+def _iniciar_trabajador(cyp2d6_phenotype_map, perfil_activo):
+    """Inicializador de los procesos del pool: la tabla CYP2D6 y una caché de diplotipos por proceso."""
+    global _mapa_trabajador, _cache_trabajador
+    _mapa_trabajador = cyp2d6_phenotype_map
+    _cache_trabajador = CacheDiplotipos()
+    PERFIL.activar(perfil_activo)
+    PERFIL.reiniciar()  # Con 'fork' el hijo copiaría las medidas ya acumuladas por el padre
+
+
+def _analizar_en_trabajador(df_genotipos_raw):
+    """Ejecuta 'run_full_analysis' en un proceso del pool y devuelve también sus medidas del perfil."""
+    resultado = run_full_analysis(df_genotipos_raw, _mapa_trabajador, cache_diplotipos=_cache_trabajador)
+    return resultado, PERFIL.instantanea(reiniciar=True) if PERFIL.activo else None
+
+
+def _analizar_en_pool(pool, df_genotipos_raw):
+    """Envía un DataFrame al pool y espera su resultado (df, error), sumando las medidas al perfil local."""
+    resultado, medidas = pool.submit(_analizar_en_trabajador, df_genotipos_raw).result()
+    if medidas:
+        PERFIL.fusionar(medidas)
+    return resultado
+
+
+def _procesar_archivo(ruta_csv, cyp2d6_phenotype_map, funcion_analisis, cache_resultados, cancelar):
+    """
+    Lee y analiza un archivo en un hilo del pool de E/S. Nunca lanza
+    excepciones: devuelve (results_df, claves, error), con 'claves' solo si
+    hay caché de resultados.
+    """
+    nombre = os.path.basename(ruta_csv)
+    if cancelar is not None and cancelar.is_set():
+        return None, None, ANALISIS_CANCELADO
+    try:
+        with medir('cohorte.lectura_csv') as medicion:
+            df_genotipos = leer_genotipos(ruta_csv)
+            medicion.filas = len(df_genotipos)
+        if cancelar is not None and cancelar.is_set():
+            return None, None, ANALISIS_CANCELADO
+        if cache_resultados is None:
+            results_df, error = funcion_analisis(df_genotipos)
+            claves = None
+        else:
+            claves = cache_resultados.claves(df_genotipos, cyp2d6_phenotype_map)
+            results_df, error = cache_resultados.analizar(
+                df_genotipos, cyp2d6_phenotype_map, claves=claves, funcion_analisis=funcion_analisis
+            )
+    except Exception as e:
+        return None, None, f"Error al procesar '{nombre}': {e}"
+    if error:
+        return None, None, f"Error al procesar '{nombre}': {error}"
+    return results_df, claves, None
+
+
+def _unir_resultados(rutas, resultados):
+    """
+    Une los resultados en el orden de 'rutas'. Las muestras repetidas en
+    varios archivos se quedan con las filas del primero. Devuelve
+    (results_df, claves o None, {ID: [archivos]}).
+    """
+    vistas = {}  # ID -> archivo donde apareció por primera vez
+    duplicados = {}
+    bloques, bloques_claves = [], []
+    for ruta, (results_df, claves, _) in zip(rutas, resultados):
+        nombre = os.path.basename(ruta)
+        repetidas = np.fromiter((muestra in vistas for muestra in results_df.index), dtype=bool, count=len(results_df))
+        if repetidas.any():
+            for muestra in results_df.index[repetidas].unique():
+                archivos = duplicados.setdefault(muestra, [vistas[muestra]])
+                if nombre not in archivos:
+                    archivos.append(nombre)
+            results_df = results_df[~repetidas]
+            claves = None if claves is None else claves[~repetidas]
+        for muestra in results_df.index.unique():
+            vistas[muestra] = nombre
+        bloques.append(results_df)
+        bloques_claves.append(claves)
+
+    if not bloques:
+        return compactar_resultados(pd.DataFrame(columns=COLUMNAS_RESULTADOS)), None, duplicados
+    results_df = concatenar_resultados(bloques)
+    claves = None
+    if all(c is not None for c in bloques_claves):
+        claves = np.concatenate(bloques_claves)
+    return results_df, claves, duplicados
+
+
+def analizar_cohorte(origen, cyp2d6_phenotype_map, hilos=None, procesos=None, cache_resultados=None,
+                     nombre_cohorte=None, progreso=None, cancelar=None):
+    """
+    Analiza todos los CSV de 'origen' (carpeta o lista de rutas) como una
+    sola cohorte. 'hilos' lee archivos en paralelo y 'procesos' ejecuta el
+    análisis (None = todos los núcleos, 1 = en el propio hilo de lectura).
+    Con 'cache_resultados' solo se analizan las muestras nuevas y, si se
+    indica 'nombre_cohorte', la cohorte unida queda guardada para la próxima
+    sesión. 'progreso(ProgresoAnalisis)' se llama al terminar cada archivo y
+    'cancelar' (threading.Event) descarta los archivos aún no analizados.
+    Devuelve (results_df, duplicados, error).
+    """
+    rutas = listar_csv(origen)
+    if not rutas:
+        return None, {}, f"No se encontraron archivos CSV en '{origen}'."
+    procesos = procesos or os.cpu_count() or 1
+    hilos = hilos or min(MAX_HILOS, len(rutas), 2 * procesos)
+    if cache_resultados is not None:
+        cache_resultados.reiniciar_contadores()
+
+    try:
+        tamanos = {ruta: os.path.getsize(ruta) for ruta in rutas}
+    except OSError as e:
+        return None, {}, f"No se pudo leer '{e.filename}': {e.strerror}"
+    bytes_totales = sum(tamanos.values())
+
+    pool_procesos = None
+    if procesos > 1:
+        pool_procesos = ProcessPoolExecutor(
+            max_workers=procesos, initializer=_iniciar_trabajador, initargs=(cyp2d6_phenotype_map, PERFIL.activo)
+        )
+        # Con 'fork' los procesos se crean todos en el primer envío: se fuerza
+        # aquí, antes de que existan los hilos de lectura
+        pool_procesos.submit(len, ()).result()
+        funcion_analisis = partial(_analizar_en_pool, pool_procesos)
+    else:
+        cache_diplotipos = CacheDiplotipos()
+        bloqueo = threading.Lock()  # La caché de diplotipos no es segura entre hilos
+
+        def funcion_analisis(df_genotipos_raw):
+            with bloqueo:
+                return run_full_analysis(df_genotipos_raw, cyp2d6_phenotype_map, cache_diplotipos=cache_diplotipos)
+
+    inicio = time.perf_counter()
+    resultados = {}
+    error = None
+    try:
+        with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='cohorte') as pool_hilos:
+            futuros = {
+                pool_hilos.submit(_procesar_archivo, ruta, cyp2d6_phenotype_map, funcion_analisis, cache_resultados, cancelar): ruta
+                for ruta in rutas
+            }
+            filas = bytes_leidos = 0
+            for futuro in as_completed(futuros):
+                if futuro.cancelled():
+                    continue
+                ruta = futuros[futuro]
+                resultados[ruta] = futuro.result()
+                error_archivo = resultados[ruta][2]
+                if error_archivo and not error:
+                    error = error_archivo
+                if error or (cancelar is not None and cancelar.is_set()):
+                    # Un error o la cancelación descartan los archivos que aún no han empezado
+                    for pendiente in futuros:
+                        pendiente.cancel()
+                    continue
+                filas += len(resultados[ruta][0])
+                bytes_leidos += tamanos[ruta]
+                if progreso is not None:
+                    progreso(ProgresoAnalisis(filas, bytes_leidos, bytes_totales, time.perf_counter() - inicio))
+    finally:
+        if pool_procesos is not None:
+            pool_procesos.shutdown(cancel_futures=True)
+
+    if cancelar is not None and cancelar.is_set():
+        return None, {}, ANALISIS_CANCELADO
+    if error:
+        return None, {}, error
+
+    with medir('cohorte.union', filas=sum(len(r[0]) for r in resultados.values())):
+        results_df, claves, duplicados = _unir_resultados(rutas, [resultados[ruta] for ruta in rutas])
+    results_df.attrs['muestras_duplicadas'] = duplicados
+    if cache_resultados is not None and nombre_cohorte and claves is not None:
+        cache_resultados.grabar_cohorte(nombre_cohorte, cyp2d6_phenotype_map, results_df.index, claves)
+    return results_df, duplicados, None
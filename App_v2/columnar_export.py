@@ -0,0 +1,164 @@
+# columnar_export.py
+# Exportación de los resultados de una cohorte a un archivo binario por
+# columnas ('.pgxcol'), pensado para otros equipos que solo necesitan los
+# genotipos y fenotipos sin volver a ejecutar el análisis:
+#   exportar_resultados(results_df, "cohorte.pgxcol")
+#   resultados = ResultadosColumnares("cohorte.pgxcol")
+#   resultados.columna('Fenotipo_CYP2D6')     # pd.Categorical
+# Cada columna se guarda como códigos enteros (int8/16/32) más su vocabulario
+# y los IDs de muestra como un bloque UTF-8 con sus offsets. Al cargar, los
+# códigos se abren con np.memmap: no se leen hasta que se usan.
+#
+# Formato: MAGIA (8 bytes) | longitud de la cabecera (uint64 LE) | cabecera
+# JSON | datos. Cada sección de datos empieza alineada a ALINEACION bytes y
+# su 'offset' en la cabecera es relativo al inicio de los datos.
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from logic_engine import COLUMNAS_RESULTADOS
+
+MAGIA = b'PGXCOL\x00\x01'
+VERSION_FORMATO = 1
+ALINEACION = 64
+EXTENSION = '.pgxcol'
+
+
+def _alinear(posicion):
+    return -(-posicion // ALINEACION) * ALINEACION
+
+
+def _dtype_codigos(n_categorias):
+    """Entero con signo más pequeño que admite los códigos (y -1 para vacíos)."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categorias <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _codificar(serie):
+    """Devuelve (códigos, vocabulario) de una columna, categórica o no."""
+    categorica = serie.array if isinstance(serie.dtype, pd.CategoricalDtype) else pd.Categorical(serie)
+    vocabulario = [str(valor) for valor in categorica.categories]
+    codigos = np.asarray(categorica.codes).astype(_dtype_codigos(len(vocabulario)), copy=False)
+    return codigos, vocabulario
+
+
+def exportar_resultados(results_df, ruta, columnas=COLUMNAS_RESULTADOS):
+    """
+    Escribe 'results_df' (índice = ID de muestra) en 'ruta' con el formato
+    '.pgxcol'. Se escribe a un temporal y se renombra al final, así que un
+    fallo no deja un archivo a medias. Devuelve el tamaño en bytes.
+    """
+    secciones = []  # (descripción en la cabecera, array)
+
+    ids = [str(muestra).encode('utf-8') for muestra in results_df.index]
+    offsets = np.zeros(len(ids) + 1, dtype='<i8')
+    np.cumsum([len(muestra) for muestra in ids], out=offsets[1:])
+    datos_ids = np.frombuffer(b''.join(ids), dtype=np.uint8)
+    indice = {
+        'nombre': results_df.index.name or 'Sample/Assay',
+        'offsets': {'dtype': offsets.dtype.str, 'longitud': len(offsets)},
+        'datos': {'dtype': datos_ids.dtype.str, 'longitud': len(datos_ids)},
+    }
+    secciones.append((indice['offsets'], offsets))
+    secciones.append((indice['datos'], datos_ids))
+
+    descripciones = []
+    for nombre in columnas:
+        codigos, vocabulario = _codificar(results_df[nombre])
+        descripcion = {'nombre': nombre, 'dtype': codigos.dtype.str, 'longitud': len(codigos), 'vocabulario': vocabulario}
+        descripciones.append(descripcion)
+        secciones.append((descripcion, codigos))
+
+    posicion = 0
+    for descripcion, array in secciones:
+        posicion = _alinear(posicion)
+        descripcion['offset'] = posicion
+        posicion += array.nbytes
+
+    cabecera = json.dumps({
+        'version': VERSION_FORMATO, 'filas': len(results_df), 'indice': indice, 'columnas': descripciones,
+    }, ensure_ascii=False).encode('utf-8')
+    inicio_datos = _alinear(len(MAGIA) + 8 + len(cabecera))
+
+    ruta_temporal = ruta + '.tmp'
+    with open(ruta_temporal, 'wb') as f:
+        f.write(MAGIA)
+        f.write(len(cabecera).to_bytes(8, 'little'))
+        f.write(cabecera)
+        for descripcion, array in secciones:
+            f.write(b'\0' * (inicio_datos + descripcion['offset'] - f.tell()))
+            f.write(array.tobytes())
+        tamano = f.tell()
+    os.replace(ruta_temporal, ruta)
+    return tamano
+
+
+class ResultadosColumnares:
+    """
+    Vista de solo lectura de un archivo '.pgxcol'. Solo se lee la cabecera al
+    abrirlo; los códigos de cada columna y los IDs se mapean en memoria y el
+    sistema operativo los carga bajo demanda.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with open(ruta, 'rb') as f:
+            if f.read(len(MAGIA)) != MAGIA:
+                raise ValueError(f"'{os.path.basename(ruta)}' no es un archivo de resultados {EXTENSION}")
+            longitud = int.from_bytes(f.read(8), 'little')
+            cabecera = json.loads(f.read(longitud).decode('utf-8'))
+        if cabecera.get('version') != VERSION_FORMATO:
+            raise ValueError(f"Versión de formato no soportada: {cabecera.get('version')}")
+        self._inicio_datos = _alinear(len(MAGIA) + 8 + longitud)
+        self.filas = cabecera['filas']
+        self.nombre_indice = cabecera['indice']['nombre']
+        self._indice = cabecera['indice']
+        self._columnas = {descripcion['nombre']: descripcion for descripcion in cabecera['columnas']}
+        self._offsets_ids = self._mapear(self._indice['offsets'])
+        self._datos_ids = self._mapear(self._indice['datos'])
+
+    def _mapear(self, descripcion):
+        if descripcion['longitud'] == 0:
+            return np.empty(0, dtype=descripcion['dtype'])  # np.memmap no admite secciones vacías
+        return np.memmap(
+            self.ruta, dtype=descripcion['dtype'], mode='r',
+            offset=self._inicio_datos + descripcion['offset'], shape=(descripcion['longitud'],)
+        )
+
+    def __len__(self):
+        return self.filas
+
+    @property
+    def columnas(self):
+        return list(self._columnas)
+
+    def vocabulario(self, nombre):
+        return list(self._columnas[nombre]['vocabulario'])
+
+    def codigos(self, nombre):
+        """Códigos de la columna (memmap de solo lectura; -1 = vacío)."""
+        return self._mapear(self._columnas[nombre])
+
+    def columna(self, nombre):
+        return pd.Categorical.from_codes(self.codigos(nombre), categories=self._columnas[nombre]['vocabulario'])
+
+    def muestra(self, fila):
+        """ID de la muestra de una fila, sin decodificar el resto."""
+        inicio, fin = self._offsets_ids[fila], self._offsets_ids[fila + 1]
+        return self._datos_ids[inicio:fin].tobytes().decode('utf-8')
+
+    def muestras(self):
+        datos = self._datos_ids.tobytes()
+        offsets = self._offsets_ids.tolist()
+        return [datos[inicio:fin].decode('utf-8') for inicio, fin in zip(offsets, offsets[1:])]
+
+    def dataframe(self, columnas=None):
+        """DataFrame de columnas categóricas indexado por muestra, como 'results_df'."""
+        columnas = self.columnas if columnas is None else columnas
+        indice = pd.Index(self.muestras(), name=self.nombre_indice)
+        return pd.DataFrame({nombre: self.columna(nombre) for nombre in columnas}, index=indice)
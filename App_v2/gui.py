@@ -2,17 +2,25 @@
 # (ACTUALIZADO con Threading para evitar congelamiento y botón de guardar)
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import pandas as pd
 import os
-import json
 import platform
 import subprocess
 import threading  # --- CAMBIO: Importar threading ---
+import queue
 import logging   # --- CAMBIO: Importar logging para errores en lote ---
 
-from logic_engine import run_full_analysis, get_recommendations
+from logic_engine import get_recommendations, cargar_mapa_cyp2d6, ANALISIS_CANCELADO
+from analysis_job import TrabajoAnalisis
+from cohort_ingest import listar_csv
 from pdf_generator import create_pdf_report
+from batch_reports import generar_informes_lote, ruta_archivo_lote, FORMATOS_ARCHIVO
+from patient_store import PatientStore
+from patient_picker import PatientPicker
+from results_cache import CacheResultados
+from columnar_export import exportar_resultados, EXTENSION as COLUMNAR_EXTENSION
+from instrumentation import PERFIL
 
 # --- CAMBIO: Configurar un logging básico para errores ---
 logging.basicConfig(filename='app_errors.log', 
@@ -20,6 +28,9 @@ logging.basicConfig(filename='app_errors.log',
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
 class App:
+    # Cada cuánto (ms) se revisa la cola de mensajes del análisis en curso
+    ANALYSIS_POLL_MS = 100
+
     def __init__(self, root):
         self.root = root
         self.root.title("Generador de Informes Farmacogenéticos v3.1")
@@ -37,18 +48,24 @@ class App:
         self.style.configure('TButton', font=('Helvetica', 10, 'bold'))
         self.style.configure('TLabelframe.Label', font=('Helvetica', 11, 'bold'))
 
-        self.genotype_df_raw = None
         self.cyp2d6_phenotype_map = {}
         self.results_df = None
+        self.analysis_job = None
         
         self.current_genotypes, self.current_phenotypes = None, None
+        self.batch_processes = os.cpu_count() or 1
+        self.batch_mode_var = tk.StringVar(value='individual')
+        self.bundle_size = 500
+        self.incremental_var = tk.BooleanVar(value=True)
         
-        self.patient_db = {}
-        self.db_filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patient_data.json")
+        # Base de datos SQLite; se abre en el primer uso (ver patient_store.py)
+        self.patient_db = PatientStore()
+        # Resultados por muestra de análisis anteriores (ver results_cache.py)
+        self.results_cache = CacheResultados()
 
         self._setup_ui()
         self._load_cyp2d6_map()
-        self._load_patient_db()
+        self._restore_last_cohort()
 
     def _setup_ui(self):
         menubar = tk.Menu(self.root)
@@ -57,7 +74,25 @@ class App:
         edit_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Editar", menu=edit_menu)
         edit_menu.add_command(label="Limpiar Formulario", command=self._clear_form)
+        edit_menu.add_command(label="Cargar Carpeta de CSV...", command=self.load_csv_folder)
         edit_menu.add_command(label="Abrir Carpeta de Informes", command=self._open_reports_folder)
+        edit_menu.add_command(label="Exportar Resultados de la Cohorte...", command=self._export_results)
+        edit_menu.add_command(label="Procesos para Informes en Lote...", command=self._ask_batch_processes)
+        batch_mode_menu = tk.Menu(edit_menu, tearoff=0)
+        edit_menu.add_cascade(label="Salida de Informes en Lote", menu=batch_mode_menu)
+        batch_mode_menu.add_radiobutton(label="Un PDF por paciente", value='individual', variable=self.batch_mode_var)
+        batch_mode_menu.add_radiobutton(label="PDFs agrupados (varios pacientes por archivo)...", value='paquete', variable=self.batch_mode_var, command=self._ask_bundle_size)
+        batch_mode_menu.add_radiobutton(label="Un único archivo ZIP (con manifiesto)", value='.zip', variable=self.batch_mode_var)
+        batch_mode_menu.add_radiobutton(label="Un único archivo TAR (con manifiesto)", value='.tar', variable=self.batch_mode_var)
+        batch_mode_menu.add_separator()
+        batch_mode_menu.add_checkbutton(label="Omitir informes sin cambios (un PDF por paciente)", variable=self.incremental_var)
+        edit_menu.add_separator()
+        profile_menu = tk.Menu(edit_menu, tearoff=0)
+        edit_menu.add_cascade(label="Perfil de Rendimiento", menu=profile_menu)
+        self.profile_var = tk.BooleanVar(value=PERFIL.activo)
+        profile_menu.add_checkbutton(label="Medir tiempos por etapa", variable=self.profile_var, command=self._toggle_profiling)
+        profile_menu.add_command(label="Exportar Perfil (JSON/CSV)...", command=self._export_profile)
+        profile_menu.add_command(label="Reiniciar Perfil", command=self._reset_profile)
         edit_menu.add_separator()
         theme_menu = tk.Menu(edit_menu, tearoff=0)
         edit_menu.add_cascade(label="Tema", menu=theme_menu)
@@ -81,10 +116,9 @@ class App:
 
         patient_select_frame = ttk.LabelFrame(main_frame, text="2. Seleccionar Paciente", padding="10")
         patient_select_frame.pack(fill=tk.X, padx=5, pady=10)
-        self.patient_var = tk.StringVar()
-        self.patient_combobox = ttk.Combobox(patient_select_frame, textvariable=self.patient_var, state="disabled", font=('Helvetica', 10))
-        self.patient_combobox.pack(fill=tk.X, expand=True)
-        self.patient_combobox.bind("<<ComboboxSelected>>", self.on_patient_select)
+        # Búsqueda por prefijo del ID; solo se listan las primeras coincidencias
+        self.patient_picker = PatientPicker(patient_select_frame, on_select=self.on_patient_select)
+        self.patient_picker.pack(fill=tk.X, expand=True)
 
         info_frame = ttk.LabelFrame(main_frame, text="3. Datos del Paciente", padding="10")
         info_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -158,50 +192,38 @@ class App:
         self.progress_bar.grid_remove()
 
         self.status_label = ttk.Label(action_frame, text="Procesando...", font=('Helvetica', 10, 'italic'))
-        self.status_label.grid(row=2, column=0, columnspan=2, sticky='ew', padx=5, pady=5)
+        self.status_label.grid(row=2, column=0, sticky='ew', padx=5, pady=5)
         self.status_label.grid_remove() 
 
+        self.cancel_button = ttk.Button(action_frame, text="Cancelar Análisis", command=self._cancel_analysis)
+        self.cancel_button.grid(row=2, column=1, sticky='e', padx=5, pady=5)
+        self.cancel_button.grid_remove()
+
+        self.profile_label = ttk.Label(action_frame, text="", font=('Courier', 9), justify=tk.LEFT)
+        self.profile_label.grid(row=3, column=0, columnspan=2, sticky='ew', padx=5, pady=5)
+        self.profile_label.grid_remove()
+
     def _load_cyp2d6_map(self):
         try:
-            filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CYP2D6_Diplotype_Phenotype_Table modificada.csv")
-            df = pd.read_csv(filepath, sep=';')
-            df.columns = df.columns.str.strip()
-            
-            # --- CAMBIO: CORREGIDO ---
-            # Esta lógica AHORA coincide con la nueva lógica de 'logic_engine.py'
-            # (ambos ordenan el diplotipo).
-            df['CYP2D6 Diplotype'] = df['CYP2D6 Diplotype'].apply(
-                lambda x: '/'.join(sorted(str(x).split('/')))
-            )
-            df = df.drop_duplicates(subset=['CYP2D6 Diplotype'])
-            
-            self.cyp2d6_phenotype_map = pd.Series(
-                df['Coded Diplotype/Phenotype Summary'].values, 
-                index=df['CYP2D6 Diplotype']
-            ).to_dict()
+            self.cyp2d6_phenotype_map = cargar_mapa_cyp2d6()
         except Exception as e:
             messagebox.showerror("Error", f"No se encontró o no se pudo leer el archivo de fenotipos CYP2D6.\nError: {e}")
             self.root.quit()
 
-    def _load_patient_db(self):
-        if os.path.exists(self.db_filepath):
-            try:
-                with open(self.db_filepath, 'r') as f:
-                    self.patient_db = json.load(f)
-            except Exception as e:
-                messagebox.showwarning("Advertencia", f"No se pudo cargar la base de datos de pacientes: {e}")
-                self.patient_db = {}
-    
+    def _restore_last_cohort(self):
+        """Muestra los resultados de la última cohorte analizada, si siguen siendo válidos."""
+        try:
+            results_df, basename = self.results_cache.cargar_cohorte(self.cyp2d6_phenotype_map)
+        except Exception as e:
+            logging.error(f"No se pudo restaurar la última cohorte: {e}")
+            return
+        if results_df is not None and not results_df.empty:
+            self._show_results(results_df, f"{basename} (restaurado)")
+
     # --- CAMBIO: Función de ayuda para guardar ---
     def _save_patient_db(self, patient_info):
-        patient_id = patient_info.get("N° Historia")
-        if not patient_id: 
-            return False
-        self.patient_db[patient_id] = patient_info
         try:
-            with open(self.db_filepath, 'w') as f:
-                json.dump(self.patient_db, f, indent=4)
-            return True
+            return self.patient_db.save(patient_info)
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo guardar la información del paciente: {e}")
             return False
@@ -224,7 +246,10 @@ class App:
         self._open_folder(folder_path)
 
     def _clear_form(self):
-        self.patient_combobox.set('')
+        self.patient_picker.clear()
+        self._clear_patient_fields()
+
+    def _clear_patient_fields(self):
         for entry in self.entries.values():
             if isinstance(entry, tk.Text):
                 entry.delete("1.0", tk.END)
@@ -236,6 +261,73 @@ class App:
         self.generate_button.config(state="disabled")
         self.save_button.config(state="disabled") # --- CAMBIO ---
         
+    def _ask_batch_processes(self):
+        processes = simpledialog.askinteger(
+            "Procesos en Lote",
+            f"Número de procesos para generar informes en lote (1 = sin paralelismo).\nNúcleos disponibles: {os.cpu_count() or 1}",
+            initialvalue=self.batch_processes, minvalue=1, maxvalue=64, parent=self.root
+        )
+        if processes:
+            self.batch_processes = processes
+        
+    def _ask_bundle_size(self):
+        bundle_size = simpledialog.askinteger(
+            "PDFs Agrupados",
+            "Pacientes por archivo PDF (0 = todos en un único archivo).\nSe creará 'indice_informes.json' con las páginas de cada paciente.",
+            initialvalue=self.bundle_size, minvalue=0, parent=self.root
+        )
+        if bundle_size is None:
+            self.batch_mode_var.set('individual')
+        else:
+            self.bundle_size = bundle_size
+        
+    def _toggle_profiling(self):
+        PERFIL.activar(self.profile_var.get())
+        self._update_profile_label()
+
+    def _reset_profile(self):
+        PERFIL.reiniciar()
+        self._update_profile_label()
+
+    def _export_profile(self):
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=(("JSON", "*.json"), ("CSV", "*.csv")),
+            initialfile="perfil_rendimiento.json"
+        )
+        if not filepath: return
+        try:
+            PERFIL.exportar(filepath)
+            messagebox.showinfo("Perfil Exportado", f"Perfil guardado en:\n{filepath}")
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo exportar el perfil:\n{e}")
+
+    def _export_results(self):
+        """Guarda 'results_df' en formato columnar para otros equipos (ver columnar_export.py)."""
+        if self.results_df is None:
+            messagebox.showwarning("Datos no procesados", "Por favor, cargue primero un archivo de genotipado.")
+            return
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=COLUMNAR_EXTENSION,
+            filetypes=(("Resultados columnares", f"*{COLUMNAR_EXTENSION}"),),
+            initialfile=f"resultados_cohorte{COLUMNAR_EXTENSION}"
+        )
+        if not filepath: return
+        try:
+            size = exportar_resultados(self.results_df, filepath)
+            messagebox.showinfo("Resultados Exportados", f"{len(self.results_df)} pacientes ({size / 1e6:.1f} MB) guardados en:\n{filepath}")
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudieron exportar los resultados:\n{e}")
+
+    def _update_profile_label(self):
+        """Muestra bajo las acciones las etapas más lentas del perfil (si está activo)."""
+        summary = PERFIL.resumen_texto() if PERFIL.activo else ""
+        if summary:
+            self.profile_label.config(text=summary)
+            self.profile_label.grid()
+        else:
+            self.profile_label.grid_remove()
+        
     def _show_about(self):
         about_text = (
             "Generador de Informes Farmacogenéticos v3.1 (Integrado con motor Pandas)\n\n"
@@ -261,42 +353,91 @@ class App:
     # --- CAMBIO: Función modificada para usar Threading ---
     def load_csv(self):
         """
-        Abre el diálogo para cargar CSV y lanza el análisis EN UN HILO SEPARADO
-        para no congelar la GUI.
+        Abre el diálogo para cargar uno o varios CSV y lanza el análisis EN UN
+        HILO SEPARADO para no congelar la GUI. Varios archivos se cargan como
+        una sola cohorte (ver cohort_ingest.py).
         """
-        filepath = filedialog.askopenfilename(filetypes=(("Archivos CSV", "*.csv"), ("Todos los archivos", "*.*")))
-        if not filepath: return
+        filepaths = filedialog.askopenfilenames(filetypes=(("Archivos CSV", "*.csv"), ("Todos los archivos", "*.*")))
+        if not filepaths: return
+        if len(filepaths) == 1:
+            self._start_analysis(filepaths[0], os.path.basename(filepaths[0]), [filepaths[0]])
+        else:
+            self._start_analysis(list(filepaths), f"{len(filepaths)} archivos CSV", filepaths)
+
+    def load_csv_folder(self):
+        """Carga todos los CSV de una carpeta (ej: una placa por archivo) como una sola cohorte."""
+        folder = filedialog.askdirectory(title="Seleccionar carpeta con los CSV de genotipado")
+        if not folder: return
+        filepaths = listar_csv(folder)
+        if not filepaths:
+            messagebox.showerror("Error de Carga", f"La carpeta '{folder}' no contiene archivos CSV.")
+            return
+        self._start_analysis(folder, f"{os.path.basename(folder)} ({len(filepaths)} archivos)", filepaths)
+
+    def _start_analysis(self, source, basename, filepaths):
         try:
-            # La lectura inicial del CSV es rápida, se puede hacer aquí
-            temp_df = pd.read_csv(filepath, sep=';', dtype={'Sample/Assay': str})
-            
-            if 'Sample/Assay' not in temp_df.columns:
-                messagebox.showerror("Error de Formato", "El archivo CSV no contiene la columna 'Sample/Assay'.")
-                return
-            
-            temp_df.dropna(subset=['Sample/Assay'], inplace=True)
-            self.genotype_df_raw = temp_df.set_index('Sample/Assay')
+            # Solo se leen las cabeceras aquí; los datos se procesan en el hilo
+            for filepath in filepaths:
+                header_df = pd.read_csv(filepath, sep=';', nrows=0)
+                if 'Sample/Assay' not in header_df.columns:
+                    messagebox.showerror("Error de Formato",
+                                         f"El archivo '{os.path.basename(filepath)}' no contiene la columna 'Sample/Assay'.")
+                    return
 
             # --- Preparar la GUI para la carga ---
             self.status_label.config(text="Archivo cargado. Procesando todos los pacientes...")
             self.status_label.grid()
+            self.progress_bar.config(maximum=1.0, value=0)
+            self.progress_bar.grid()
+            self.cancel_button.config(state="normal")
+            self.cancel_button.grid()
             self._set_ui_state("disabled") # Desactiva botones
             self.root.update_idletasks()
             
-            # --- Lanzar la tarea pesada (run_full_analysis) en un hilo ---
-            def task():
-                # Esta función se ejecuta en el hilo secundario
-                results_df, error = run_full_analysis(self.genotype_df_raw, self.cyp2d6_phenotype_map)
-                # Cuando termina, llama a 'on_analysis_complete' en el hilo principal
-                self.root.after(0, self.on_analysis_complete, results_df, error, os.path.basename(filepath))
-            
-            threading.Thread(target=task, daemon=True).start()
+            # --- Lanzar el análisis como trabajo en segundo plano ---
+            self.analysis_job = TrabajoAnalisis(source, self.cyp2d6_phenotype_map, self.results_cache, basename).iniciar()
+            self.root.after(self.ANALYSIS_POLL_MS, self._poll_analysis_job, self.analysis_job, basename)
 
         except Exception as e:
             self.status_label.grid_remove() 
             self._set_ui_state("normal") # Reactiva botones si falla
             messagebox.showerror("Error de Carga", f"No se pudo leer o procesar el archivo.\nError: {e}")
 
+    def _poll_analysis_job(self, job, basename):
+        """Vacía la cola del trabajo de análisis desde el hilo principal (ver analysis_job.py)."""
+        try:
+            while True:
+                message = job.cola.get_nowait()
+                if message[0] == 'progreso':
+                    self._show_analysis_progress(message[1])
+                else:
+                    _, results_df, error = message
+                    self.analysis_job = None
+                    self.progress_bar.grid_remove()
+                    self.cancel_button.grid_remove()
+                    self.on_analysis_complete(results_df, error, basename)
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(self.ANALYSIS_POLL_MS, self._poll_analysis_job, job, basename)
+
+    def _show_analysis_progress(self, progress):
+        if self.analysis_job is not None and self.analysis_job.cancelado:
+            return
+        self.progress_bar.config(value=progress.fraccion)
+        text = f"Procesando... {progress.filas} muestras ({progress.filas_por_segundo:.0f} muestras/s)"
+        if progress.eta_segundos is not None:
+            minutes, seconds = divmod(int(progress.eta_segundos), 60)
+            text += f" · quedan {minutes:d}:{seconds:02d}"
+        self.status_label.config(text=text)
+
+    def _cancel_analysis(self):
+        if self.analysis_job is None:
+            return
+        self.analysis_job.cancelar()
+        self.cancel_button.config(state="disabled")
+        self.status_label.config(text="Cancelando el análisis...")
+
     # --- CAMBIO: Nueva función callback para el hilo de 'load_csv' ---
     def on_analysis_complete(self, results_df, error, basename):
         """
@@ -304,33 +445,60 @@ class App:
         """
         self.status_label.grid_remove()
         self._set_ui_state("normal") # Reactiva botones
+        self._update_profile_label()
 
+        if error == ANALISIS_CANCELADO:
+            messagebox.showinfo("Análisis Cancelado", "El análisis se ha cancelado. Se mantienen los resultados anteriores.")
+            return
         if error:
             messagebox.showerror("Error de Análisis", error)
             return
         
-        self.results_df = results_df
+        self._show_results(results_df, basename)
         
-        patients = self.results_df.index.tolist()
-        self.patient_combobox['values'] = patients
-        self.patient_combobox.config(state="readonly")
+        summary_message = f"Proceso completado. Se encontraron y analizaron {len(results_df)} pacientes."
+        reuse_stats = self.results_df.attrs.get('cache_resultados')
+        if reuse_stats:
+            summary_message += (f"\n\nResultados reutilizados de análisis anteriores: {reuse_stats['reutilizadas']}"
+                                f"\nMuestras nuevas o modificadas analizadas: {reuse_stats['analizadas']}")
+        duplicates = self.results_df.attrs.get('muestras_duplicadas')
+        if duplicates:
+            summary_message += (f"\n\n{len(duplicates)} muestras aparecen en varios archivos; "
+                                "se usan los resultados del primero:")
+            for patient_id, files in list(duplicates.items())[:5]:
+                summary_message += f"\n • {patient_id}: {', '.join(files)}"
+            if len(duplicates) > 5:
+                summary_message += f"\n • ... y {len(duplicates) - 5} más"
+        cache_stats = self.results_df.attrs.get('cache_diplotipos')
+        if cache_stats:
+            summary_message += "\n\nCaché de diplotipos (aciertos / firmas resueltas):"
+            for gene, stats in cache_stats.items():
+                summary_message += f"\n • {gene}: {stats['aciertos']} / {stats['fallos']}"
+        messagebox.showinfo("Éxito", summary_message)
+
+    def _show_results(self, results_df, basename):
+        self.results_df = results_df
+        self.patient_picker.set_patients(self.results_df.index)
+        self.patient_picker.set_state("normal")
         self.batch_button.config(state="normal")
         self.file_path_var.set(basename)
-        
-        messagebox.showinfo("Éxito", f"Proceso completado. Se encontraron y analizaron {len(patients)} pacientes.")
 
-    def on_patient_select(self, event=None):
+    def on_patient_select(self, selected_patient_id=None):
         """
         Busca los resultados pre-calculados.
         """
-        selected_patient_id = self.patient_var.get()
         if not selected_patient_id or self.results_df is None: 
             return
             
-        self._clear_form()
+        self._clear_patient_fields()
         
-        if selected_patient_id in self.patient_db:
-            for key, value in self.patient_db[selected_patient_id].items():
+        try:
+            saved_info = self.patient_db.get(selected_patient_id, {})
+        except Exception as e:
+            messagebox.showwarning("Advertencia", f"No se pudo cargar la base de datos de pacientes: {e}")
+            saved_info = {}
+        if saved_info:
+            for key, value in saved_info.items():
                 if key in self.entries and isinstance(self.entries[key], tk.Text):
                     self.entries[key].insert("1.0", value)
                 elif key in self.entries:
@@ -339,7 +507,11 @@ class App:
         self.entries["N° Historia"].insert(0, selected_patient_id)
         
         try:
-            patient_results = self.results_df.loc[selected_patient_id]
+            # Fila por posición desde el índice del selector (O(1))
+            position = self.patient_picker.position(selected_patient_id)
+            if position is None:
+                raise KeyError(selected_patient_id)
+            patient_results = self.results_df.iloc[position]
             
             self.current_genotypes = {
                 'DPYD': patient_results['DPYD'],
@@ -412,6 +584,7 @@ class App:
             
             recommendations = get_recommendations(self.current_phenotypes)
             pdf_filename, error = create_pdf_report(patient_info, self.current_genotypes, self.current_phenotypes, recommendations)
+            self._update_profile_label()
             
             if error:
                 messagebox.showerror("Error al crear PDF", error)
@@ -437,55 +610,45 @@ class App:
         self.progress_bar.config(maximum=len(self.results_df), value=0)
         self._set_ui_state("disabled") # Desactiva botones
         
-        # --- Lanzar la tarea pesada en un hilo ---
-        def task():
-            success_count, fail_count = 0, 0
-            output_folder = "Informes_Lote"
+        # Las variables de Tk se leen aquí, en el hilo principal
+        batch_mode = self.batch_mode_var.get()
+        bundle_size = self.bundle_size if batch_mode == 'paquete' else None
+        incremental = self.incremental_var.get()
+        output_folder = "Informes_Lote"
+        archive = ruta_archivo_lote(output_folder, batch_mode) if batch_mode in FORMATOS_ARCHIVO else None
         
-            for patient_id, row in self.results_df.iterrows():
-                try:
-                    genotypes = {
-                        'DPYD': row['DPYD'],
-                        'CYP2D6': row['CYP2D6'],
-                        'UGT1A1': row['UGT1A1']
-                    }
-                    phenotypes = {
-                        'DPYD': row['Fenotipo_DPYD'],
-                        'CYP2D6': row['Fenotipo_CYP2D6'],
-                        'UGT1A1': row['Fenotipo_UGT1A1']
-                    }
-                    
-                    recommendations = get_recommendations(phenotypes)
-                    patient_info = self.patient_db.get(patient_id, {"N° Historia": patient_id})
-                    
-                    _, error = create_pdf_report(patient_info, genotypes, phenotypes, recommendations, folder=output_folder)
-                    
-                    if error: 
-                        fail_count += 1
-                        logging.error(f"Fallo al generar PDF para {patient_id}: {error}")
-                    else: 
-                        success_count += 1
-                except Exception as e:
-                    fail_count += 1
-                    logging.error(f"Fallo crítico al procesar paciente {patient_id}: {e}")
-                
-                # Actualiza la barra de progreso desde el hilo principal
-                self.root.after(0, self.progress_bar.step, 1)
+        # --- Lanzar la tarea pesada en un hilo (que a su vez reparte en procesos) ---
+        def task():
+            success_count, fail_count, skip_count = 0, 0, 0
+            try:
+                success_count, fail_count, skip_count = generar_informes_lote(
+                    self.results_df, self.patient_db, output_folder,
+                    procesos=self.batch_processes, pacientes_por_archivo=bundle_size, incremental=incremental,
+                    archivo=archive,
+                    # Actualiza la barra de progreso desde el hilo principal
+                    progreso=lambda n: self.root.after(0, self.progress_bar.step, n)
+                )
+            except Exception as e:
+                fail_count = len(self.results_df) - success_count - skip_count
+                logging.error(f"Fallo crítico en la generación en lote: {e}")
             
             # Llama al callback final en el hilo principal
-            self.root.after(0, self.on_batch_complete, success_count, fail_count, output_folder)
+            self.root.after(0, self.on_batch_complete, success_count, fail_count, output_folder, skip_count)
         
         threading.Thread(target=task, daemon=True).start()
 
     # --- CAMBIO: Nueva función callback para el hilo de 'generate_batch_reports' ---
-    def on_batch_complete(self, success_count, fail_count, output_folder):
+    def on_batch_complete(self, success_count, fail_count, output_folder, skip_count=0):
         """
         Se ejecuta en el hilo principal cuando 'generate_batch_reports' termina.
         """
         self.progress_bar.grid_remove()
         self._set_ui_state("normal") # Reactiva botones
+        self._update_profile_label()
         
         summary_message = f"Proceso completado.\n\nInformes generados: {success_count}\nInformes fallidos: {fail_count}"
+        if skip_count:
+            summary_message += f"\nInformes sin cambios (omitidos): {skip_count}"
         
         if fail_count > 0:
             summary_message += f"\n\nSe registraron {fail_count} errores en el archivo 'app_errors.log'."
@@ -500,4 +663,4 @@ class App:
         self.batch_button.config(state=state)
         self.generate_button.config(state=state if state == "normal" and self.current_genotypes else "disabled")
         self.save_button.config(state=state if state == "normal" and self.current_genotypes else "disabled")
-        self.patient_combobox.config(state=state if state == "normal" else "disabled")
\ No newline at end of file
+        self.patient_picker.set_state(state if state == "normal" and self.results_df is not None else "disabled")
\ No newline at end of file
@@ -0,0 +1,130 @@
+# headless.py
+# Punto de entrada en línea de comandos (sin Tk) para trabajos en lote nocturnos:
+#   python headless.py genotipo.csv carpeta_salida [--procesos N] [--paquete N] [--incremental]
+#   python headless.py genotipo.csv carpeta_salida --archivo zip   (un solo .zip con manifiesto)
+#   python headless.py placa1.csv placa2.csv ... carpeta_salida   (o una carpeta de CSV)
+# Los módulos pesados (pandas, reportlab) se importan solo cuando se necesitan.
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Genera los informes farmacogenéticos de un CSV de genotipado sin interfaz gráfica."
+    )
+    parser.add_argument("csv", nargs="+",
+                        help="CSV de genotipado (';' como separador, columna 'Sample/Assay'). Con varios archivos o una "
+                             "carpeta, se analizan en paralelo y se unen en una sola cohorte.")
+    parser.add_argument("salida", help="Carpeta donde se guardan los informes.")
+    parser.add_argument("--procesos", type=int, default=0,
+                        help="Procesos para analizar varios CSV y para generar los PDF (0 = todos los núcleos, 1 = sin paralelismo).")
+    output_mode = parser.add_mutually_exclusive_group()
+    output_mode.add_argument("--paquete", type=int, default=None, metavar="N",
+                             help="Agrupa N pacientes por PDF (0 = un único PDF) en lugar de un PDF por paciente.")
+    output_mode.add_argument("--archivo", choices=["zip", "tar", "tar.gz"], default=None,
+                             help="Guarda todos los PDF en un único archivo ZIP o TAR (con manifiesto) dentro de la carpeta de salida.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Omite los informes cuyas entradas no han cambiado desde la última ejecución en la misma carpeta.")
+    parser.add_argument("--exportar", metavar="RUTA",
+                        help="Guarda además los resultados de la cohorte en formato columnar (.pgxcol, ver columnar_export.py).")
+    parser.add_argument("--hilos", type=int, default=None, metavar="N",
+                        help="Archivos leídos a la vez al cargar varios CSV (por defecto, según los procesos).")
+    parser.add_argument("--bloque", type=int, default=None, metavar="FILAS",
+                        help="Filas del CSV analizadas por bloque.")
+    parser.add_argument("--pacientes", default=None,
+                        help="Base de datos SQLite de pacientes (por defecto, patient_data.sqlite3 junto a la aplicación).")
+    parser.add_argument("--cache", default=None, metavar="RUTA",
+                        help="Caché SQLite de resultados por muestra (por defecto, resultados_cache.sqlite3 junto a la aplicación).")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="Analiza todas las muestras sin consultar ni actualizar la caché de resultados.")
+    parser.add_argument("--perfil", metavar="RUTA",
+                        help="Activa la instrumentación por etapa y guarda el perfil en RUTA (.json o .csv).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    timings = {}
+
+    start = time.perf_counter()
+    from instrumentation import PERFIL
+    PERFIL.activar(bool(args.perfil))
+    import logic_engine
+    import batch_reports
+    import patient_store
+    import results_cache
+    timings['importaciones'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        cyp2d6_phenotype_map = logic_engine.cargar_mapa_cyp2d6()
+    except Exception as e:
+        print(f"Error: no se pudo leer la tabla de fenotipos CYP2D6: {e}", file=sys.stderr)
+        return 2
+    patient_db = patient_store.PatientStore(args.pacientes) if args.pacientes else patient_store.PatientStore()
+    cache = None
+    if not args.sin_cache:
+        cache = results_cache.CacheResultados(args.cache) if args.cache else results_cache.CacheResultados()
+    timings['carga de datos'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    duplicates = {}
+    if len(args.csv) == 1 and not os.path.isdir(args.csv[0]):
+        results_sink = logic_engine.DestinoMemoria()
+        chunk_kwargs = {'tamano_bloque': args.bloque} if args.bloque else {}
+        _, error = logic_engine.analizar_csv_por_bloques(
+            args.csv[0], cyp2d6_phenotype_map, results_sink, cache_resultados=cache, **chunk_kwargs
+        )
+        results_df = None if error else results_sink.resultado()
+    else:
+        import cohort_ingest
+        origin = args.csv[0] if len(args.csv) == 1 else args.csv
+        results_df, duplicates, error = cohort_ingest.analizar_cohorte(
+            origin, cyp2d6_phenotype_map, hilos=args.hilos, procesos=args.procesos or None, cache_resultados=cache
+        )
+    if error:
+        print(error, file=sys.stderr)
+        return 2
+    timings['análisis'] = time.perf_counter() - start
+
+    if args.exportar:
+        start = time.perf_counter()
+        import columnar_export
+        columnar_export.exportar_resultados(results_df, args.exportar)
+        timings['exportación'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    archive = batch_reports.ruta_archivo_lote(args.salida, '.' + args.archivo) if args.archivo else None
+    success_count, fail_count, skip_count = batch_reports.generar_informes_lote(
+        results_df, patient_db, args.salida, procesos=args.procesos, pacientes_por_archivo=args.paquete,
+        incremental=args.incremental, archivo=archive
+    )
+    timings['informes'] = time.perf_counter() - start
+
+    total = sum(timings.values())
+    n_patients = len(results_df)
+    print(f"Pacientes: {n_patients}  Informes generados: {success_count}  Fallidos: {fail_count}  Sin cambios: {skip_count}")
+    if archive:
+        print(f"Archivo de informes: {archive}")
+    if duplicates:
+        examples = ", ".join(f"{sample} ({' / '.join(files)})" for sample, files in list(duplicates.items())[:5])
+        print(f"Muestras repetidas en varios archivos (se usa el primero): {len(duplicates)}  ej: {examples}")
+    if cache is not None:
+        print(f"Caché de resultados: {cache.reutilizadas} reutilizados, {cache.analizadas} analizados")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<16} {seconds:9.3f} s")
+    print(f"  {'total':<16} {total:9.3f} s  ({n_patients / total if total else 0:.1f} pacientes/s)")
+    if args.perfil:
+        PERFIL.exportar(args.perfil)
+        print(f"Perfil por etapa guardado en '{args.perfil}':")
+        print(PERFIL.resumen_texto(max_etapas=20))
+    return 1 if fail_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# instrumentation.py
+# Tiempos y contadores por etapa del análisis y de los informes.
+#   with medir('analisis.mapeo', filas=len(df)):
+#       ...
+# Desactivado por defecto: 'medir' devuelve entonces un objeto vacío
+# compartido y no toma tiempos. Se activa con PERFIL.activar(), con la
+# variable de entorno PGX_PERFIL=1, desde el menú de la GUI o con
+# 'headless.py --perfil'.
+
+import os
+import csv
+import json
+import time
+import threading
+
+CAMPOS = ['etapa', 'llamadas', 'segundos', 'filas', 'bytes']
+
+
+class _Medicion:
+    """Contexto de una etapa. Dentro del bloque se pueden ajustar 'filas' y 'bytes'."""
+    __slots__ = ('perfil', 'etapa', 'filas', 'bytes', 'inicio')
+
+    def __init__(self, perfil, etapa, filas):
+        self.perfil = perfil
+        self.etapa = etapa
+        self.filas = filas
+        self.bytes = 0
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.perfil.anotar(self.etapa, time.perf_counter() - self.inicio, 1, self.filas, self.bytes)
+        return False
+
+
+class _SinMedicion:
+    """Sustituto de '_Medicion' cuando el perfil está desactivado: no hace nada."""
+    filas = 0
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, nombre, valor):
+        pass
+
+
+_SIN_MEDICION = _SinMedicion()
+
+
+class Perfil:
+    """Acumula por etapa: llamadas, segundos (reloj de pared), filas y bytes escritos."""
+
+    def __init__(self, activo=False):
+        self.activo = activo
+        self._datos = {}
+        self._bloqueo = threading.Lock()
+
+    def activar(self, activo=True):
+        self.activo = activo
+
+    def etapa(self, nombre, filas=0):
+        if not self.activo:
+            return _SIN_MEDICION
+        return _Medicion(self, nombre, filas)
+
+    def anotar(self, etapa, segundos=0.0, llamadas=1, filas=0, bytes_escritos=0):
+        with self._bloqueo:
+            datos = self._datos.get(etapa)
+            if datos is None:
+                datos = self._datos[etapa] = [0, 0.0, 0, 0]
+            datos[0] += llamadas
+            datos[1] += segundos
+            datos[2] += filas
+            datos[3] += bytes_escritos
+
+    def fusionar(self, instantanea):
+        """Suma una instantánea (ej: la de un proceso del pool) a este perfil."""
+        for fila in instantanea:
+            self.anotar(fila['etapa'], fila['segundos'], fila['llamadas'], fila['filas'], fila['bytes'])
+
+    def instantanea(self, reiniciar=False):
+        """Devuelve una lista de dicts (uno por etapa, en orden alfabético)."""
+        with self._bloqueo:
+            filas = [
+                {'etapa': etapa, 'llamadas': d[0], 'segundos': d[1], 'filas': d[2], 'bytes': d[3]}
+                for etapa, d in sorted(self._datos.items())
+            ]
+            if reiniciar:
+                self._datos = {}
+        return filas
+
+    def reiniciar(self):
+        with self._bloqueo:
+            self._datos = {}
+
+    def resumen_texto(self, max_etapas=8):
+        """Resumen corto para la barra de estado de la GUI (las etapas más lentas)."""
+        filas = sorted(self.instantanea(), key=lambda f: f['segundos'], reverse=True)[:max_etapas]
+        return "\n".join(
+            f"{f['etapa']}: {f['segundos']:.3f} s · {f['llamadas']} llamadas"
+            + (f" · {f['filas']} filas" if f['filas'] else "")
+            + (f" · {f['bytes'] / 1e6:.1f} MB" if f['bytes'] else "")
+            for f in filas
+        )
+
+    def exportar(self, ruta):
+        """Guarda el perfil como CSV (si la ruta acaba en .csv) o como JSON."""
+        filas = self.instantanea()
+        if ruta.lower().endswith('.csv'):
+            with open(ruta, 'w', newline='', encoding='utf-8') as f:
+                escritor = csv.DictWriter(f, fieldnames=CAMPOS, delimiter=';')
+                escritor.writeheader()
+                escritor.writerows(filas)
+        else:
+            with open(ruta, 'w', encoding='utf-8') as f:
+                json.dump(filas, f, indent=4, ensure_ascii=False)
+
+
+# Perfil global del proceso
+PERFIL = Perfil(activo=os.environ.get('PGX_PERFIL', '') not in ('', '0'))
+
+
+def medir(etapa, filas=0):
+    """Atajo de PERFIL.etapa(...) para usar con 'with'."""
+    return PERFIL.etapa(etapa, filas)
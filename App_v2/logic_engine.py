@@ -2,8 +2,19 @@
 # VERSIÓN CON 'combinar_gen' SIN ORDENACIÓN FINAL 'sorted()'
 
 import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
 import json
 import os
+import re
+import io
+import hashlib
+import pickle
+import threading
+import time
+from contextlib import closing
+
+from instrumentation import medir
 
 # === 1. Funciones del motor de análisis (de tu script) ===
 
@@ -39,6 +50,65 @@ def mapear_nts_a_alelos(serie_snp: pd.Series, reglas_map: dict):
     return serie_mapeada
 
 
+def codificar_alelos(serie_snp: pd.Series, reglas_map: dict, tabla_genotipos=None):
+    """
+    Forma compacta del mapeo de una columna de genotipos: devuelve
+    (códigos, alelos), donde 'códigos' es un array de enteros con una entrada
+    por fila y 'alelos[c]' la tupla de alelos del genotipo distinto 'c'
+    (ej: ('*1', '*2A')). Cada genotipo distinto se convierte una sola vez.
+    'tabla_genotipos' (opcional) es un dict {genotipo: alelos} de la columna
+    que se reutiliza entre llamadas (ver 'ConjuntoReglas').
+    """
+    reglas_columna = reglas_map.get(serie_snp.name, dict())
+    if tabla_genotipos is None:
+        tabla_genotipos = {}
+
+    # 'use_na_sentinel=False' conserva los NaN como un valor más ('nan'),
+    # igual que hace str(celda) en la versión original.
+    codigos, genotipos_unicos = pd.factorize(serie_snp, use_na_sentinel=False)
+
+    tabla_alelos = []
+    for celda_genotipo in genotipos_unicos:
+        if not isinstance(celda_genotipo, str):
+            celda_genotipo = str(celda_genotipo)
+        alelos = tabla_genotipos.get(celda_genotipo)
+        if alelos is None:
+            alelos = tuple(reglas_columna.get(nt, '*1') for nt in celda_genotipo.split('/'))
+            tabla_genotipos[celda_genotipo] = alelos
+        tabla_alelos.append(alelos)
+    return codigos, tabla_alelos
+
+
+def mapear_nts_a_alelos_vectorizado(serie_snp: pd.Series, reglas_map: dict, tabla_genotipos=None):
+    """
+    Versión vectorizada de 'mapear_nts_a_alelos'. En lugar de partir cada
+    celda, factoriza la columna (ver 'codificar_alelos'), convierte una sola
+    vez cada genotipo distinto (ej: 'C/G') y reparte el resultado a todas las
+    filas indexando con los códigos en un array de NumPy.
+    Devuelve exactamente las mismas listas de alelos que la versión original,
+    incluido el '*1' por defecto para nucleótidos desconocidos.
+    """
+    codigos, alelos_unicos = codificar_alelos(serie_snp, reglas_map, tabla_genotipos)
+    tabla_alelos = np.empty(len(alelos_unicos), dtype=object)
+    for i, alelos in enumerate(alelos_unicos):
+        tabla_alelos[i] = list(alelos)
+    return pd.Series(tabla_alelos[codigos], index=serie_snp.index, name=serie_snp.name)
+
+
+def categorica_desde_tabla(codigos, valores) -> pd.Categorical:
+    """
+    Devuelve el equivalente categórico de 'valores[codigos]' sin crear un
+    texto por fila. 'valores' puede repetir textos (se unifican en el
+    vocabulario); un código -1 queda como vacío.
+    """
+    codigos = np.asarray(codigos)
+    codigos_valores, vocabulario = pd.factorize(np.asarray(valores, dtype=object))
+    nuevos_codigos = codigos_valores[codigos] if len(codigos_valores) else np.full(len(codigos), -1)
+    if len(codigos) and codigos.min() < 0:
+        nuevos_codigos = np.where(codigos >= 0, nuevos_codigos, -1)
+    return pd.Categorical.from_codes(nuevos_codigos, categories=vocabulario)
+
+
 def combinar_gen(lista_de_alelos_por_snp: list, gen: str):
     """
     Combina los alelos de múltiples SNPs de un gen en un diplotipo final.
@@ -116,6 +186,217 @@ def combinar_gen(lista_de_alelos_por_snp: list, gen: str):
     return 'Error/Logica'
 
 
+# === 1a. Motor de resolución de diplotipos por tabla ===
+# Misma lógica que 'combinar_gen', pero descrita como datos y aplicada sobre
+# recuentos de alelos de todas las firmas a la vez. Un gen nuevo solo
+# necesita (si acaso) su entrada en REGLAS_DIPLOTIPOS.
+
+ALELO_REFERENCIA = '*1'
+# Alelos que 'combinar_gen' coloca detrás del resto al formar el diplotipo
+ALELOS_AL_FINAL = ('*4', '*10', '*10*4')
+DIPLOTIPO_ERROR = 'Error/Logica'
+
+# Por gen: 'combinaciones' [(alelos consumidos, alelo resultante)] se aplican
+# en orden, cada una tantas veces como se pueda; después se eliminan los
+# alelos de 'descartar'. Los genes sin entrada no combinan nada.
+REGLAS_DIPLOTIPOS = {
+    'CYP2D6': {
+        'combinaciones': [
+            (('*10*4', '*10', '*4'), '*4'),
+            (('*10*4', '*10'), '*10'),
+        ],
+        'descartar': ('*10',),
+    },
+}
+_REGLA_SIN_COMBINACIONES = {'combinaciones': [], 'descartar': ()}
+
+
+class MotorDiplotipos:
+    """
+    Tabla de resolución de un gen compilada para unas columnas concretas
+    ('tablas_columnas[j][c]' = tupla de alelos del código 'c' de la columna
+    'j', como en 'CacheDiplotipos.combinar_codigos').
+    Cada columna se convierte en una matriz código -> recuento por alelo, y
+    'resolver' trabaja con la matriz de recuentos de todas las firmas.
+    El orden de los alelos en el diplotipo sale del orden de las columnas,
+    así que solo es equivalente a 'combinar_gen' si cada alelo viene de una
+    única columna y cada columna da como mucho un alelo distinto de *1:
+    si no, 'valido' es False y hay que usar 'combinar_gen'.
+    """
+
+    def __init__(self, gen, tablas_columnas):
+        regla = REGLAS_DIPLOTIPOS.get(gen, _REGLA_SIN_COMBINACIONES)
+        columnas_por_alelo = {}
+        self.valido = True
+        for j, tabla in enumerate(tablas_columnas):
+            alelos_columna = {alelo for alelos in tabla for alelo in alelos if alelo != ALELO_REFERENCIA}
+            if len(alelos_columna) > 1:
+                self.valido = False
+            for alelo in alelos_columna:
+                columnas_por_alelo.setdefault(alelo, []).append(j)
+        if any(len(columnas) > 1 for columnas in columnas_por_alelo.values()):
+            self.valido = False
+
+        # Vocabulario en el orden del diplotipo: el resto por columna, luego ALELOS_AL_FINAL por columna
+        por_columna = sorted(columnas_por_alelo, key=lambda alelo: columnas_por_alelo[alelo][0])
+        self.alelos = (
+            [a for a in por_columna if a not in ALELOS_AL_FINAL] + [a for a in por_columna if a in ALELOS_AL_FINAL]
+        )
+        for consumidos, _ in regla['combinaciones']:
+            self.alelos += [a for a in consumidos if a not in self.alelos]
+        posicion = {alelo: i for i, alelo in enumerate(self.alelos)}
+
+        self.recuentos_columnas = []
+        for tabla in tablas_columnas:
+            recuentos = np.zeros((len(tabla), len(self.alelos)), dtype=np.int32)
+            for codigo, alelos in enumerate(tabla):
+                for alelo in alelos:
+                    if alelo != ALELO_REFERENCIA:
+                        recuentos[codigo, posicion[alelo]] += 1
+            self.recuentos_columnas.append(recuentos)
+
+        self.combinaciones = [
+            ([posicion[a] for a in consumidos], resultante) for consumidos, resultante in regla['combinaciones']
+        ]
+        self.descartar = [posicion[a] for a in regla['descartar'] if a in posicion]
+        # Etiquetas de los dos lados del diplotipo: referencia, alelos combinados y alelos sueltos
+        self.etiquetas = [ALELO_REFERENCIA] + [resultante for _, resultante in self.combinaciones] + self.alelos
+
+    def resolver(self, codigos_firmas):
+        """Diplotipo (texto) de cada fila de 'codigos_firmas' (firmas x columnas)."""
+        n_firmas = len(codigos_firmas)
+        restantes = np.zeros((n_firmas, len(self.alelos)), dtype=np.int32)
+        for j, recuentos in enumerate(self.recuentos_columnas):
+            restantes += recuentos[codigos_firmas[:, j]]
+
+        combinados = np.zeros((n_firmas, len(self.combinaciones)), dtype=np.int32)
+        for r, (consumidos, _) in enumerate(self.combinaciones):
+            veces = restantes[:, consumidos].min(axis=1)
+            restantes[:, consumidos] -= veces[:, None]
+            combinados[:, r] = veces
+        restantes[:, self.descartar] = 0
+
+        # Primer y segundo elemento de cada secuencia: primera posición con suma acumulada >= 1 y >= 2
+        acumulado_f, acumulado_r = combinados.cumsum(axis=1), restantes.cumsum(axis=1)
+        n_f = acumulado_f[:, -1] if combinados.shape[1] else np.zeros(n_firmas, dtype=np.int32)
+        n_r = acumulado_r[:, -1] if restantes.shape[1] else np.zeros(n_firmas, dtype=np.int32)
+        f0 = 1 + np.argmax(acumulado_f >= 1, axis=1) if combinados.shape[1] else np.zeros(n_firmas, dtype=np.intp)
+        f1 = 1 + np.argmax(acumulado_f >= 2, axis=1) if combinados.shape[1] else np.zeros(n_firmas, dtype=np.intp)
+        desplazamiento = 1 + len(self.combinaciones)
+        r0 = desplazamiento + np.argmax(acumulado_r >= 1, axis=1) if restantes.shape[1] else np.zeros(n_firmas, dtype=np.intp)
+        r1 = desplazamiento + np.argmax(acumulado_r >= 2, axis=1) if restantes.shape[1] else np.zeros(n_firmas, dtype=np.intp)
+
+        # Mismos casos que el final de 'combinar_gen'; -1 = 'Error/Logica'
+        casos = [
+            (n_f == 0) & (n_r == 0), (n_f == 0) & (n_r == 1), (n_f == 0) & (n_r >= 2),
+            (n_f == 1) & (n_r == 1), (n_f == 1) & (n_r == 0), n_f == 2,
+        ]
+        izquierda = np.select(casos, [0, 0, r0, f0, 0, f0], default=-1)
+        derecha = np.select(casos, [0, r0, r1, r0, f0, f1], default=-1)
+
+        pares, inversa = np.unique(np.stack([izquierda, derecha], axis=1), axis=0, return_inverse=True)
+        textos = np.array([
+            DIPLOTIPO_ERROR if i < 0 else f'{self.etiquetas[i]}/{self.etiquetas[d]}' for i, d in pares.tolist()
+        ], dtype=object)
+        return textos[inversa.ravel()]
+
+
+def _firmas_unicas(codigos_firma):
+    """
+    Como 'np.unique(codigos_firma, axis=0, return_inverse=True)', pero sin
+    ordenar: cada firma se empaqueta en un entero y se factoriza por hash.
+    """
+    n_muestras, n_columnas = codigos_firma.shape
+    if n_columnas == 0:
+        return np.zeros((1, 0), dtype=np.intp), np.zeros(n_muestras, dtype=np.intp)
+    dimensiones = tuple(int(d) for d in codigos_firma.max(axis=0) + 1)
+    try:
+        claves = np.ravel_multi_index(codigos_firma.T, dimensiones)
+    except ValueError:  # Demasiadas combinaciones para un entero de 64 bits
+        return np.unique(codigos_firma, axis=0, return_inverse=True)
+    inversa, claves_unicas = pd.factorize(claves)
+    return np.column_stack(np.unravel_index(claves_unicas, dimensiones)), inversa
+
+
+class CacheDiplotipos:
+    """
+    Resolución de diplotipos para 'run_full_analysis'.
+    Agrupa las muestras por su firma de alelos (la tupla de llamadas de
+    todos los SNPs del gen) y resuelve todas las firmas distintas a la vez
+    con 'MotorDiplotipos'. Si la tabla de un gen no es aplicable, resuelve
+    cada firma con 'combinar_gen' y la guarda para siguientes llamadas.
+    Cuenta aciertos (muestras servidas sin resolver su firma) y fallos
+    (firmas que hubo que resolver) por gen.
+    """
+
+    def __init__(self):
+        self.resultados = {}
+        self.aciertos = {}
+        self.fallos = {}
+
+    def combinar(self, df_alelos_gen: pd.DataFrame, gen: str) -> pd.Series:
+        """
+        Equivale a 'df_alelos_gen.apply(lambda fila: combinar_gen(fila.tolist(), gen), axis=1)',
+        pero devuelve una columna categórica.
+        """
+        # Cada columna se factoriza por separado (tuplas de alelos -> códigos)
+        tablas_columnas, codigos_columnas = [], []
+        for _, columna in df_alelos_gen.items():
+            codigos, alelos_unicos = pd.factorize(columna.map(tuple))
+            codigos_columnas.append(codigos)
+            tablas_columnas.append(alelos_unicos.tolist())
+        return self.combinar_codigos(codigos_columnas, tablas_columnas, gen, df_alelos_gen.index)
+
+    def combinar_codigos(self, codigos_columnas: list, tablas_columnas: list, gen: str, index) -> pd.Series:
+        """
+        Como 'combinar', con los SNPs del gen ya codificados (ver 'codificar_alelos'):
+        'codigos_columnas[j]' tiene un código por muestra y 'tablas_columnas[j][c]'
+        es la tupla de alelos del código 'c'. Devuelve una Series categórica.
+        """
+        n_muestras = len(index)
+        if n_muestras == 0:
+            return pd.Series(pd.Categorical([]), index=index)
+        if codigos_columnas:
+            codigos_firma = np.column_stack(codigos_columnas)
+        else:
+            codigos_firma = np.zeros((n_muestras, 0), dtype=np.intp)
+
+        firmas_unicas, inversa = _firmas_unicas(codigos_firma)
+
+        motor = MotorDiplotipos(gen, tablas_columnas)
+        if motor.valido:
+            diplotipos_unicos = motor.resolver(firmas_unicas)
+            fallos = len(firmas_unicas)
+        else:
+            diplotipos_unicos, fallos = self._combinar_firmas(firmas_unicas, tablas_columnas, gen)
+
+        self.fallos[gen] = self.fallos.get(gen, 0) + fallos
+        self.aciertos[gen] = self.aciertos.get(gen, 0) + n_muestras - fallos
+        return pd.Series(categorica_desde_tabla(inversa.ravel(), diplotipos_unicos), index=index)
+
+    def _combinar_firmas(self, firmas_unicas, tablas_columnas, gen):
+        """Resuelve firma a firma con 'combinar_gen'. Devuelve (diplotipos, firmas nuevas)."""
+        diplotipos_unicos = np.empty(len(firmas_unicas), dtype=object)
+        fallos = 0
+        for i, fila_codigos in enumerate(firmas_unicas.tolist()):
+            firma = tuple(tablas_columnas[j][codigo] for j, codigo in enumerate(fila_codigos))
+            clave = (gen, firma)
+            diplotipo = self.resultados.get(clave)
+            if diplotipo is None:
+                diplotipo = combinar_gen([list(alelos) for alelos in firma], gen)
+                self.resultados[clave] = diplotipo
+                fallos += 1
+            diplotipos_unicos[i] = diplotipo
+        return diplotipos_unicos, fallos
+
+    def resumen(self) -> dict:
+        """Devuelve {gen: {'aciertos': n, 'fallos': m}}."""
+        return {
+            gen: {'aciertos': self.aciertos.get(gen, 0), 'fallos': self.fallos.get(gen, 0)}
+            for gen in self.fallos
+        }
+
+
 def fenotipo_dpyd(geno: str) -> str:
     """Asigna fenotipo de DPYD basado en la 'dosis' de alelos *1."""
     if geno == '*1/*1':
@@ -135,135 +416,511 @@ def fenotipo_ugt1a1(geno: str) -> str:
         return 'Metabolizador lento'
 
 
+# === 1b. Reglas de alelos compiladas ===
+
+RUTA_REGLAS_ALELOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reglas_alelos.json')
+GENES_ANALIZADOS = ['DPYD', 'UGT1A1', 'CYP2D6']
+
+
+class ConjuntoReglas:
+    """
+    Reglas de 'reglas_alelos.json' cargadas una sola vez, validadas y listas
+    para usar: el mapa {columna: {nucleótido: alelo}}, una tabla por columna
+    {genotipo: alelos} que se va llenando entre análisis, y el índice
+    gen -> columnas (y los nombres limpios) para cada cabecera de CSV vista.
+    'version' es el SHA-256 del JSON.
+    """
+
+    def __init__(self, mapa_reglas: dict, version: str):
+        self.mapa = mapa_reglas
+        self.version = version
+        self._tablas_genotipos = {}
+        self._nombres_limpios = {}
+        self._columnas_por_gen = {}
+
+    @classmethod
+    def desde_json(cls, ruta_json):
+        with open(ruta_json, 'rb') as f:
+            contenido = f.read()
+        mapa_reglas = json.loads(contenido)
+        if not isinstance(mapa_reglas, dict):
+            raise ValueError("el archivo debe contener un objeto {columna: {nucleótido: alelo}}")
+        for columna, reglas_columna in mapa_reglas.items():
+            if not isinstance(reglas_columna, dict) or not all(
+                isinstance(nt, str) and isinstance(alelo, str) for nt, alelo in reglas_columna.items()
+            ):
+                raise ValueError(f"las reglas de '{columna}' deben ser un objeto {{nucleótido: alelo}} de textos")
+        return cls(mapa_reglas, hashlib.sha256(contenido).hexdigest())
+
+    def tabla_genotipos(self, columna):
+        """Tabla {genotipo: alelos} de la columna, compartida entre llamadas."""
+        tabla = self._tablas_genotipos.get(columna)
+        if tabla is None:
+            tabla = self._tablas_genotipos.setdefault(columna, {})
+        return tabla
+
+    def nombres_limpios(self, columnas):
+        """Cambia '*' por '_' en las cabeceras (ej: 'CYP2D6*3' -> 'CYP2D6_3')."""
+        clave = tuple(columnas)
+        nombres = self._nombres_limpios.get(clave)
+        if nombres is None:
+            nombres = self._nombres_limpios[clave] = [c.replace('*', '_') for c in clave]
+        return nombres
+
+    def columnas_por_gen(self, columnas_limpias):
+        """Devuelve {gen: [columnas del gen]} para una cabecera ya limpia."""
+        clave = tuple(columnas_limpias)
+        indice = self._columnas_por_gen.get(clave)
+        if indice is None:
+            indice = self._columnas_por_gen[clave] = {
+                gen: [c for c in clave if gen in c] for gen in GENES_ANALIZADOS
+            }
+        return indice
+
+
+_reglas_cargadas = {}
+_bloqueo_reglas = threading.Lock()
+
+
+def cargar_reglas(ruta_json=RUTA_REGLAS_ALELOS):
+    """
+    Devuelve el 'ConjuntoReglas' del JSON, compilado una sola vez y guardado
+    en memoria. Se recarga solo si cambia la fecha de modificación o el tamaño
+    del archivo. Lanza FileNotFoundError o ValueError si no se puede usar.
+    """
+    estado = os.stat(ruta_json)
+    firma = (estado.st_mtime_ns, estado.st_size)
+    with _bloqueo_reglas:
+        cargadas = _reglas_cargadas.get(ruta_json)
+        if cargadas is None or cargadas[0] != firma:
+            cargadas = _reglas_cargadas[ruta_json] = (firma, ConjuntoReglas.desde_json(ruta_json))
+        return cargadas[1]
+
+
+# === 1c. Tabla de fenotipos CYP2D6 ===
+
+RUTA_TABLA_CYP2D6 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CYP2D6_Diplotype_Phenotype_Table modificada.csv")
+
+
+VERSION_CACHE_CYP2D6 = 1
+
+
+def _compilar_mapa_cyp2d6(origen_csv):
+    """Lee la tabla (ruta o buffer) y construye el dict de diplotipos ordenados."""
+    df = pd.read_csv(origen_csv, sep=';')
+    df.columns = df.columns.str.strip()
+    
+    # Las claves se guardan ordenadas (ej: '*4/*1' -> '*1/*4')
+    df['CYP2D6 Diplotype'] = df['CYP2D6 Diplotype'].apply(
+        lambda x: '/'.join(sorted(str(x).split('/')))
+    )
+    df = df.drop_duplicates(subset=['CYP2D6 Diplotype'])
+    
+    return pd.Series(
+        df['Coded Diplotype/Phenotype Summary'].values, 
+        index=df['CYP2D6 Diplotype']
+    ).to_dict()
+
+
+def cargar_mapa_cyp2d6(ruta_csv=RUTA_TABLA_CYP2D6, usar_cache=True):
+    """
+    Lee la tabla de diplotipos CYP2D6 y devuelve un dict
+    {diplotipo ordenado (ej: '*1/*4'): resumen del fenotipo}.
+    El dict ya compilado se guarda junto al CSV ('<csv>.cache.pkl') y se
+    reutiliza mientras no cambien ni el hash SHA-256 ni la fecha de
+    modificación del CSV (ni 'VERSION_CACHE_CYP2D6').
+    Lanza la excepción original si el archivo no se puede leer.
+    """
+    if not usar_cache:
+        return _compilar_mapa_cyp2d6(ruta_csv)
+
+    with open(ruta_csv, 'rb') as f:
+        contenido = f.read()
+    firma = {
+        'version': VERSION_CACHE_CYP2D6,
+        'sha256': hashlib.sha256(contenido).hexdigest(),
+        'mtime_ns': os.stat(ruta_csv).st_mtime_ns,
+    }
+
+    ruta_cache = ruta_csv + '.cache.pkl'
+    try:
+        with open(ruta_cache, 'rb') as f:
+            cache = pickle.load(f)
+        if cache.get('firma') == firma:
+            return cache['mapa']
+    except Exception:
+        pass  # Sin caché o caché corrupta/antigua: se recompila
+
+    mapa = _compilar_mapa_cyp2d6(io.BytesIO(contenido))
+    try:
+        ruta_temporal = ruta_cache + '.tmp'
+        with open(ruta_temporal, 'wb') as f:
+            pickle.dump({'firma': firma, 'mapa': mapa}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta_temporal, ruta_cache)
+    except OSError:
+        pass  # Carpeta de solo lectura: se sigue sin caché
+    return mapa
+
+
+FENOTIPOS_CYP2D6_ES = {
+    "Normal": "Metabolizador normal",
+    "Intermediate": "Metabolizador intermedio",
+    "Poor": "Metabolizador lento",
+    "Ultrarapid": "Metabolizador ultrarrápido",
+    "Indeterminate": "Indeterminado"
+}
+
+
+def diplotipo_canonico(geno_str) -> str:
+    """Clave de búsqueda independiente del orden (ej: '*4/*1' -> '*1/*4'), como las de la tabla."""
+    return '/'.join(sorted(str(geno_str).split('/')))
+
+
+def _traducir_fenotipo_cyp2d6(phenotype_info: str) -> str:
+    phenotype_en = phenotype_info.split(';')[0].strip().replace(" Metabolizer", "")
+    return FENOTIPOS_CYP2D6_ES.get(phenotype_en, "Indeterminado")
+
+
+def fenotipo_cyp2d6(geno_str: str, pheno_map: dict) -> str:
+    """Asigna fenotipo de CYP2D6 buscando el diplotipo en la tabla CPIC."""
+    # 'combinar_gen' no ordena el diplotipo (ej. *17/*3): se busca por su forma canónica
+    phenotype_info = pheno_map.get(diplotipo_canonico(geno_str), "Indeterminate")
+    return _traducir_fenotipo_cyp2d6(phenotype_info)
+
+
+_indices_cyp2d6 = {}  # id(mapa) -> (mapa, {diplotipo canónico: fenotipo en español})
+
+
+def indice_fenotipos_cyp2d6(pheno_map: dict) -> dict:
+    """
+    Tabla {diplotipo canónico: fenotipo en español} del mapa CYP2D6, con los
+    resúmenes ya traducidos. Se construye una vez por objeto de mapa.
+    """
+    guardado = _indices_cyp2d6.get(id(pheno_map))
+    if guardado is not None and guardado[0] is pheno_map:
+        return guardado[1]
+    indice = {
+        diplotipo_canonico(diplotipo): _traducir_fenotipo_cyp2d6(str(resumen))
+        for diplotipo, resumen in pheno_map.items()
+    }
+    _indices_cyp2d6[id(pheno_map)] = (pheno_map, indice)
+    return indice
+
+
+def fenotipar_columna(serie_diplotipos: pd.Series, funcion) -> pd.Series:
+    """
+    Aplica 'funcion' (diplotipo -> fenotipo) a una columna entera: evalúa
+    cada diplotipo distinto (categoría) una sola vez y devuelve una columna
+    categórica con los mismos códigos.
+    """
+    if isinstance(serie_diplotipos.dtype, pd.CategoricalDtype):
+        codigos, diplotipos_unicos = serie_diplotipos.cat.codes.to_numpy(), serie_diplotipos.cat.categories
+    else:
+        codigos, diplotipos_unicos = pd.factorize(serie_diplotipos, use_na_sentinel=False)
+    fenotipos_unicos = [funcion(diplotipo) for diplotipo in diplotipos_unicos]
+    return pd.Series(
+        categorica_desde_tabla(codigos, fenotipos_unicos), index=serie_diplotipos.index, name=serie_diplotipos.name
+    )
+
+
+def fenotipar_cyp2d6(serie_diplotipos: pd.Series, pheno_map: dict) -> pd.Series:
+    """Versión por columnas de 'fenotipo_cyp2d6' (mismo resultado para cada fila)."""
+    indice = indice_fenotipos_cyp2d6(pheno_map)
+    return fenotipar_columna(
+        serie_diplotipos, lambda geno: indice.get(diplotipo_canonico(geno), "Indeterminado")
+    )
+
+
 # === 2. Función principal (wrapper) que la GUI llamará ===
 
-def run_full_analysis(df_genotipos_raw, cyp2d6_phenotype_map):
+COLUMNAS_RESULTADOS = ['DPYD', 'UGT1A1', 'CYP2D6', 'Fenotipo_DPYD', 'Fenotipo_UGT1A1', 'Fenotipo_CYP2D6']
+
+def run_full_analysis(df_genotipos_raw, cyp2d6_phenotype_map, vectorizado=True, cache_diplotipos=None):
     """
     Función principal que ejecuta todo el pipeline de análisis de pandas.
     Toma el DataFrame crudo y el mapa de fenotipos de CYP2D6.
-    Devuelve un DataFrame final con todos los resultados.
+    Con 'vectorizado=True' cada SNP se codifica con 'codificar_alelos'
+    (enteros + tabla de alelos, sin una lista por celda); con False se usa
+    la versión original celda a celda (mismos resultados).
+    'cache_diplotipos' permite reutilizar una 'CacheDiplotipos' entre llamadas;
+    sus aciertos/fallos quedan en 'df.attrs["cache_diplotipos"]'.
+    Devuelve un DataFrame final con todos los resultados, con columnas
+    categóricas (códigos enteros + vocabulario compartido).
     """
     
+    n_filas = len(df_genotipos_raw)
+
     # === 1. CARGAR REGLAS ===
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    json_path = os.path.join(script_dir, 'reglas_alelos.json')
+    # Compiladas una vez y reutilizadas mientras el JSON no cambie
     try:
-        with open(json_path, 'r') as f:
-            mapa_reglas_alelos = json.load(f)
+        with medir('analisis.1_reglas'):
+            reglas = cargar_reglas()
     except FileNotFoundError:
         return None, "Error: No se encontró 'reglas_alelos.json'. Asegúrate de que está en la misma carpeta."
     except Exception as e:
         return None, f"Error al leer 'reglas_alelos.json': {e}"
 
     # === 2. PROCESAR GENOTIPOS RAW ===
-    df_genotipos_para_procesar = df_genotipos_raw.copy()
-    
-    nombres_columnas_limpios = list(map(lambda x: x.replace('*','_'), df_genotipos_para_procesar.columns))
-    df_genotipos_para_procesar.columns = nombres_columnas_limpios
-    
-    df_alelos_mapeados = df_genotipos_para_procesar.apply(
-        lambda columna: mapear_nts_a_alelos(columna, mapa_reglas_alelos)
-    )
+    with medir('analisis.2_mapeo', filas=n_filas):
+        # 'set_axis' renombra sin duplicar todo el DataFrame crudo con '.copy()'
+        nombres_columnas_limpios = reglas.nombres_limpios(df_genotipos_raw.columns)
+        df_genotipos_para_procesar = df_genotipos_raw.set_axis(nombres_columnas_limpios, axis=1)
+        
+        if vectorizado:
+            # {columna: (códigos por muestra, tuplas de alelos por código)}
+            alelos_codificados = {
+                columna: codificar_alelos(serie, reglas.mapa, reglas.tabla_genotipos(columna))
+                for columna, serie in df_genotipos_para_procesar.items()
+            }
+        else:
+            df_alelos_mapeados = df_genotipos_para_procesar.apply(lambda columna: mapear_nts_a_alelos(columna, reglas.mapa))
     
     # === 3. COMBINAR ALELOS POR GEN ===
+    # Cada firma de alelos distinta se resuelve una sola vez (ver 'CacheDiplotipos')
+    if cache_diplotipos is None:
+        cache_diplotipos = CacheDiplotipos()
     df_resultados_finales = pd.DataFrame(index=df_genotipos_para_procesar.index)
-    
-    df_resultados_finales['DPYD'] = df_alelos_mapeados[
-        [c for c in df_alelos_mapeados.columns if 'DPYD' in c]
-    ].apply(lambda fila: combinar_gen(fila.tolist(), 'DPYD'), axis=1) # .tolist() es importante
 
-    df_resultados_finales['UGT1A1'] = df_alelos_mapeados[
-        [c for c in df_alelos_mapeados.columns if 'UGT1A1' in c]
-    ].apply(lambda fila: combinar_gen(fila.tolist(), 'UGT1A1'), axis=1)
-
-    df_resultados_finales['CYP2D6'] = df_alelos_mapeados[
-        [c for c in df_alelos_mapeados.columns if 'CYP2D6' in c]
-    ].apply(lambda fila: combinar_gen(fila.tolist(), 'CYP2D6'), axis=1)
+    columnas_por_gen = reglas.columnas_por_gen(nombres_columnas_limpios)
+    for gen in GENES_ANALIZADOS:
+        columnas = columnas_por_gen[gen]
+        with medir(f'analisis.3_combinacion.{gen}', filas=n_filas):
+            if vectorizado:
+                df_resultados_finales[gen] = cache_diplotipos.combinar_codigos(
+                    [alelos_codificados[c][0] for c in columnas], [alelos_codificados[c][1] for c in columnas],
+                    gen, df_resultados_finales.index
+                )
+            else:
+                df_resultados_finales[gen] = cache_diplotipos.combinar(df_alelos_mapeados[columnas], gen)
+    # Libera los alelos antes de fenotipar
+    if vectorizado:
+        del alelos_codificados
+    else:
+        del df_alelos_mapeados
     
     # === 4. ASIGNAR FENOTIPOS ===
-    df_resultados_finales['Fenotipo_DPYD'] = df_resultados_finales['DPYD'].apply(fenotipo_dpyd)
-    df_resultados_finales['Fenotipo_UGT1A1'] = df_resultados_finales['UGT1A1'].apply(fenotipo_ugt1a1)
-    
-    # Lógica de mapeo de fenotipo CYP2D6
-    def map_cyp2d6_pheno(geno_str, pheno_map):
-        # La GUI pasa 'cyp2d6_phenotype_map' (un dict)
-        # 'geno_str' NO ESTÁ ORDENADO (ej. *17/*3) según tu lógica.
-        phenotype_info = pheno_map.get(geno_str, "Indeterminate")
-        
-        phenotype_en = phenotype_info.split(';')[0].strip().replace(" Metabolizer", "")
-        
-        phenotype_map_es = {
-            "Normal": "Metabolizador normal",
-            "Intermediate": "Metabolizador intermedio",
-            "Poor": "Metabolizador lento",
-            "Ultrarapid": "Metabolizador ultrarrápido",
-            "Indeterminate": "Indeterminado"
-        }
-        return phenotype_map_es.get(phenotype_en, "Indeterminado")
-
-    df_resultados_finales['Fenotipo_CYP2D6'] = df_resultados_finales['CYP2D6'].apply(
-        lambda geno: map_cyp2d6_pheno(geno, cyp2d6_phenotype_map)
-    )
+    # Cada diplotipo distinto se fenotipa una sola vez (ver 'fenotipar_columna')
+    with medir('analisis.4_fenotipos', filas=n_filas):
+        df_resultados_finales['Fenotipo_DPYD'] = fenotipar_columna(df_resultados_finales['DPYD'], fenotipo_dpyd)
+        df_resultados_finales['Fenotipo_UGT1A1'] = fenotipar_columna(df_resultados_finales['UGT1A1'], fenotipo_ugt1a1)
+        df_resultados_finales['Fenotipo_CYP2D6'] = fenotipar_cyp2d6(df_resultados_finales['CYP2D6'], cyp2d6_phenotype_map)
 
+    df_resultados_finales.attrs['cache_diplotipos'] = cache_diplotipos.resumen()
     return df_resultados_finales, None # Devuelve el DF y no-error
 
 
+# === 2b. Modo streaming para CSVs muy grandes ===
+
+TAMANO_BLOQUE_DEFECTO = 50000
+
+
+# Valor de error de 'analizar_csv_por_bloques' cuando se cancela el análisis
+ANALISIS_CANCELADO = "Análisis cancelado por el usuario."
+
+
+class ProgresoAnalisis:
+    """Estado de un análisis por bloques tras cada bloque: filas hechas y bytes del CSV leídos."""
+    __slots__ = ('filas', 'bytes_leidos', 'bytes_totales', 'segundos')
+
+    def __init__(self, filas, bytes_leidos, bytes_totales, segundos):
+        self.filas = filas
+        self.bytes_leidos = bytes_leidos
+        self.bytes_totales = bytes_totales
+        self.segundos = segundos
+
+    @property
+    def fraccion(self):
+        """Parte del archivo ya procesada (0-1)."""
+        return min(1.0, self.bytes_leidos / self.bytes_totales) if self.bytes_totales else 0.0
+
+    @property
+    def filas_por_segundo(self):
+        return self.filas / self.segundos if self.segundos else 0.0
+
+    @property
+    def eta_segundos(self):
+        """Tiempo restante estimado (None hasta terminar el primer bloque)."""
+        if not self.fraccion:
+            return None
+        return self.segundos * (1 - self.fraccion) / self.fraccion
+
+
+def leer_genotipos_por_bloques(ruta_csv, tamano_bloque=TAMANO_BLOQUE_DEFECTO):
+    """
+    Lee un CSV de genotipado ('Sample/Assay' + una columna por SNP) en bloques
+    de 'tamano_bloque' filas. Cada bloque sale ya limpio e indexado por muestra,
+    igual que el DataFrame que la GUI pasaba a 'run_full_analysis'.
+    'ruta_csv' también puede ser un archivo ya abierto en modo binario.
+    """
+    with pd.read_csv(ruta_csv, sep=';', dtype={'Sample/Assay': str}, chunksize=tamano_bloque) as lector:
+        for bloque in lector:
+            if 'Sample/Assay' not in bloque.columns:
+                raise ValueError("El archivo CSV no contiene la columna 'Sample/Assay'.")
+            bloque = bloque.dropna(subset=['Sample/Assay'])
+            yield bloque.set_index('Sample/Assay')
+
+
+class DestinoMemoria:
+    """Destino de resultados que acumula los bloques y los une al final."""
+
+    def __init__(self):
+        self.bloques = []
+
+    def __call__(self, df_bloque):
+        self.bloques.append(df_bloque)
+
+    def resultado(self):
+        if not self.bloques:
+            return compactar_resultados(pd.DataFrame(columns=COLUMNAS_RESULTADOS))
+        return concatenar_resultados(self.bloques)
+
+
+def compactar_resultados(df_resultados):
+    """Convierte en categóricas las columnas de resultados que aún sean de texto."""
+    columnas = [c for c in COLUMNAS_RESULTADOS if c in df_resultados and not isinstance(df_resultados[c].dtype, pd.CategoricalDtype)]
+    if not columnas:
+        return df_resultados
+    return df_resultados.astype({c: 'category' for c in columnas})
+
+
+def concatenar_resultados(bloques):
+    """
+    Une DataFrames de resultados por filas sin perder las columnas categóricas
+    ('pd.concat' las pasaría a texto si cada bloque tiene su propio vocabulario).
+    """
+    if len(bloques) == 1:
+        return compactar_resultados(bloques[0])
+    bloques = [compactar_resultados(bloque) for bloque in bloques]
+    indice = bloques[0].index.append([bloque.index for bloque in bloques[1:]])
+    columnas = {}
+    for columna in bloques[0].columns:
+        partes = [bloque[columna] for bloque in bloques]
+        if all(isinstance(parte.dtype, pd.CategoricalDtype) for parte in partes):
+            columnas[columna] = union_categoricals(partes)
+        else:
+            columnas[columna] = pd.concat(partes, ignore_index=True).to_numpy()
+    return pd.DataFrame(columnas, index=indice)
+
+
+class DestinoCSV:
+    """Destino de resultados que va añadiendo cada bloque a un CSV (';')."""
+
+    def __init__(self, ruta_csv):
+        self.ruta_csv = ruta_csv
+        self.filas_escritas = 0
+
+    def __call__(self, df_bloque):
+        df_bloque.to_csv(
+            self.ruta_csv, sep=';', index_label='Sample/Assay',
+            mode='w' if self.filas_escritas == 0 else 'a',
+            header=self.filas_escritas == 0
+        )
+        self.filas_escritas += len(df_bloque)
+
+
+def analizar_csv_por_bloques(ruta_csv, cyp2d6_phenotype_map, destino, tamano_bloque=TAMANO_BLOQUE_DEFECTO, cache_diplotipos=None,
+                             cache_resultados=None, progreso=None, cancelar=None):
+    """
+    Ejecuta el pipeline completo (mapeo, combinación y fenotipado) bloque a
+    bloque y entrega cada DataFrame de resultados a 'destino' (cualquier
+    función que acepte un DataFrame, ej: 'DestinoCSV' o 'DestinoMemoria').
+    La memoria máxima depende del tamaño de bloque, no del tamaño de la cohorte.
+    La 'CacheDiplotipos' se comparte entre bloques. Con 'cache_resultados'
+    (una 'results_cache.CacheResultados') solo se analizan las muestras que
+    no estén ya en la caché persistente.
+    Tras cada bloque llama a 'progreso(ProgresoAnalisis)' si se indica. Con
+    'cancelar' (un threading.Event) el análisis se detiene antes del siguiente
+    bloque en cuanto se activa y devuelve el error ANALISIS_CANCELADO.
+    Devuelve (n_muestras_analizadas, error).
+    """
+    if cache_diplotipos is None:
+        cache_diplotipos = CacheDiplotipos()
+    n_muestras = 0
+    inicio = time.perf_counter()
+    try:
+        bytes_totales = os.path.getsize(ruta_csv)
+        # El lector se cierra antes que el archivo, también al salir antes de tiempo
+        with open(ruta_csv, 'rb') as archivo, closing(leer_genotipos_por_bloques(archivo, tamano_bloque)) as bloques:
+            while True:
+                if cancelar is not None and cancelar.is_set():
+                    return n_muestras, ANALISIS_CANCELADO
+                with medir('analisis.0_lectura_csv') as medicion:
+                    df_bloque = next(bloques, None)
+                    medicion.filas = 0 if df_bloque is None else len(df_bloque)
+                if df_bloque is None:
+                    break
+                if cache_resultados is not None:
+                    resultados_bloque, error = cache_resultados.analizar(df_bloque, cyp2d6_phenotype_map, cache_diplotipos)
+                else:
+                    resultados_bloque, error = run_full_analysis(df_bloque, cyp2d6_phenotype_map, cache_diplotipos=cache_diplotipos)
+                if error:
+                    return n_muestras, error
+                destino(resultados_bloque)
+                n_muestras += len(resultados_bloque)
+                if progreso is not None:
+                    progreso(ProgresoAnalisis(n_muestras, archivo.tell(), bytes_totales, time.perf_counter() - inicio))
+    except Exception as e:
+        return n_muestras, f"Error al procesar '{os.path.basename(ruta_csv)}': {e}"
+    return n_muestras, None
+
+
 # === 3. Función de recomendaciones (la mantenemos del anterior) ===
 
+# Palabras clave para poner en negrita
+PALABRAS_CLAVE = [
+    "reducir dosis", "reducción de la dosis", "evitar el uso", "riesgo aumentado",
+    "alternativa terapéutica", "fármaco alternativo", "terapia endocrina alternativa",
+    "fracaso terapéutico", "toxicidad grave o mortal", "toxicidad aumentada"
+]
+
+# Un solo patrón con cada palabra clave en minúscula y con la inicial en mayúscula
+_PATRON_PALABRAS_CLAVE = re.compile('|'.join(
+    re.escape(variante)
+    for variante in sorted({v for k in PALABRAS_CLAVE for v in (k, k.capitalize())}, key=len, reverse=True)
+))
+
+RECOMENDACION_INDETERMINADA = 'Fenotipo indeterminado. No se pueden realizar recomendaciones.'
+
+TEXTOS_RECOMENDACIONES = {
+    'DPYD': {
+        'Metabolizador normal': 'Dosis estándar según ficha técnica.',
+        'Metabolizador intermedio': 'Riesgo de toxicidad aumentada. Considerar una reducción de la dosis inicial del 50% seguida de titulación según tolerancia.',
+        'Metabolizador lento': 'Alto riesgo de toxicidad grave o mortal. Evitar el uso de fluoropirimidinas. Considerar un fármaco alternativo.',
+    },
+    'CYP2D6': {
+        'Metabolizador normal': 'Dosis estándar según ficha técnica.',
+        'Metabolizador ultrarrápido': 'Dosis estándar según ficha técnica.',
+        'Metabolizador intermedio': 'Riesgo de menor eficacia. Considerar una terapia endocrina alternativa (ej. inhibidor de la aromatasa).',
+        'Metabolizador lento': 'Alto riesgo de fracaso terapéutico. Se recomienda el uso de una terapia endocrina alternativa (ej. inhibidor de la aromatasa).',
+    },
+    'UGT1A1': {
+        'Metabolizador normal': 'Dosis estándar según ficha técnica.',
+        'Metabolizador intermedio': 'Riesgo aumentado de neutropenia. Considerar iniciar con la dosis estándar; vigilar toxicidad hematológica.',
+        'Metabolizador lento': 'Alto riesgo de neutropenia grave. Se recomienda una reducción de la dosis inicial de al menos un 30%.',
+    },
+}
+
+
+def resaltar_palabras_clave(text):
+    """Envuelve las palabras clave en <b> para ReportLab."""
+    return _PATRON_PALABRAS_CLAVE.sub(r'<b>\g<0></b>', text)
+
+
+# {gen: {fenotipo: recomendación ya resaltada}}, calculada una vez al importar
+# el módulo (los procesos del pool la heredan o la calculan al importarlo).
+TABLA_RECOMENDACIONES = {
+    gen: {fenotipo: resaltar_palabras_clave(texto) for fenotipo, texto in textos.items()}
+    for gen, textos in TEXTOS_RECOMENDACIONES.items()
+}
+_RECOMENDACION_INDETERMINADA_RESALTADA = resaltar_palabras_clave(RECOMENDACION_INDETERMINADA)
+
+
 def get_recommendations(phenotypes):
     """
     Devuelve recomendaciones terapéuticas.
     """
-    recs = {}
-    
-    # Palabras clave para poner en negrita
-    keywords = [
-        "reducir dosis", "reducción de la dosis", "evitar el uso", "riesgo aumentado",
-        "alternativa terapéutica", "fármaco alternativo", "terapia endocrina alternativa",
-        "fracaso terapéutico", "toxicidad grave o mortal", "toxicidad aumentada"
-    ]
-
-    def highlight_keywords(text):
-        """Envuelve las palabras clave en <b> para ReportLab."""
-        for keyword in keywords:
-            text = text.replace(keyword, f"<b>{keyword}</b>")
-            text = text.replace(keyword.capitalize(), f"<b>{keyword.capitalize()}</b>")
-        return text
-
-    # DPYD
-    dpyd_pheno = phenotypes.get('DPYD', 'Indeterminado')
-    if dpyd_pheno == 'Metabolizador normal':
-        rec_text = 'Dosis estándar según ficha técnica.'
-    elif dpyd_pheno == 'Metabolizador intermedio':
-        rec_text = 'Riesgo de toxicidad aumentada. Considerar una reducción de la dosis inicial del 50% seguida de titulación según tolerancia.'
-    elif dpyd_pheno == 'Metabolizador lento':
-        rec_text = 'Alto riesgo de toxicidad grave o mortal. Evitar el uso de fluoropirimidinas. Considerar un fármaco alternativo.'
-    else:
-        rec_text = 'Fenotipo indeterminado. No se pueden realizar recomendaciones.'
-    recs['DPYD'] = highlight_keywords(rec_text)
-
-    # CYP2D6
-    cyp2d6_pheno = phenotypes.get('CYP2D6', 'Indeterminado')
-    if cyp2d6_pheno in ['Metabolizador normal', 'Metabolizador ultrarrápido']:
-        rec_text = 'Dosis estándar según ficha técnica.'
-    elif cyp2d6_pheno == 'Metabolizador intermedio':
-        rec_text = 'Riesgo de menor eficacia. Considerar una terapia endocrina alternativa (ej. inhibidor de la aromatasa).'
-    elif cyp2d6_pheno == 'Metabolizador lento':
-        rec_text = 'Alto riesgo de fracaso terapéutico. Se recomienda el uso de una terapia endocrina alternativa (ej. inhibidor de la aromatasa).'
-    else:
-        rec_text = 'Fenotipo indeterminado. No se pueden realizar recomendaciones.'
-    recs['CYP2D6'] = highlight_keywords(rec_text)
-
-    # UGT1A1
-    ugt1a1_pheno = phenotypes.get('UGT1A1', 'Indeterminado')
-    if ugt1a1_pheno == 'Metabolizador normal':
-        rec_text = 'Dosis estándar según ficha técnica.'
-    elif ugt1a1_pheno == 'Metabolizador intermedio':
-        rec_text = 'Riesgo aumentado de neutropenia. Considerar iniciar con la dosis estándar; vigilar toxicidad hematológica.'
-    elif ugt1a1_pheno == 'Metabolizador lento':
-        rec_text = 'Alto riesgo de neutropenia grave. Se recomienda una reducción de la dosis inicial de al menos un 30%.'
-    else:
-        rec_text = 'Fenotipo indeterminado. No se pueden realizar recomendaciones.'
-    recs['UGT1A1'] = highlight_keywords(rec_text)
-    
-    return recs
\ No newline at end of file
+    with medir('recomendaciones', filas=1):
+        return {
+            gen: tabla.get(phenotypes.get(gen, 'Indeterminado'), _RECOMENDACION_INDETERMINADA_RESALTADA)
+            for gen, tabla in TABLA_RECOMENDACIONES.items()
+        }
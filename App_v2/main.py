@@ -1,9 +1,17 @@
 # main.py
+# Sin argumentos abre la interfaz gráfica. Con argumentos ejecuta el modo sin
+# interfaz (ver headless.py) y no llega a importar tkinter ni la GUI.
 
-import tkinter as tk
-from gui import App
+import sys
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from headless import main
+        sys.exit(main())
+
+    import tkinter as tk
+    from gui import App
+
     root = tk.Tk()
     app = App(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
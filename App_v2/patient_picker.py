@@ -0,0 +1,121 @@
+# patient_picker.py
+# Selector de pacientes para cohortes grandes: un campo de búsqueda y una
+# lista que solo muestra las primeras coincidencias del prefijo escrito.
+# Sustituye al Combobox con todos los IDs, que con decenas de miles de
+# muestras tardaba en llenarse y no se podía recorrer.
+
+import tkinter as tk
+from tkinter import ttk
+from bisect import bisect_left
+
+
+class PatientIndex:
+    """
+    Índice ordenado de los IDs de 'results_df' (sin distinguir mayúsculas).
+    'search' devuelve las coincidencias de un prefijo con dos búsquedas
+    binarias y 'position' la fila de un ID en O(1).
+    """
+
+    def __init__(self, patient_ids=()):
+        ids = [str(patient_id) for patient_id in patient_ids]
+        # Un ID repetido aparece una vez y abre su primera fila (el lote sí genera un informe por fila)
+        self._positions = {}
+        for position, patient_id in enumerate(ids):
+            self._positions.setdefault(patient_id, position)
+        self._ids = sorted(self._positions, key=str.casefold)
+        self._keys = [patient_id.casefold() for patient_id in self._ids]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def search(self, prefix, limit):
+        """Devuelve (primeros 'limit' IDs que empiezan por 'prefix', total de coincidencias)."""
+        prefix = prefix.strip().casefold()
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + '\U0010ffff', lo=start) if prefix else len(self._keys)
+        return self._ids[start:min(end, start + limit)], end - start
+
+    def position(self, patient_id):
+        """Fila del paciente en 'results_df' (None si no está)."""
+        return self._positions.get(patient_id)
+
+
+class PatientPicker(ttk.Frame):
+    """Campo de búsqueda y lista acotada de coincidencias; llama a 'on_select(patient_id)' al elegir uno."""
+    MAX_RESULTS = 200
+
+    def __init__(self, master, on_select, max_results=MAX_RESULTS, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_select = on_select
+        self.max_results = max_results
+        self.index = PatientIndex()
+        self.selected_id = None
+        self.columnconfigure(0, weight=1)
+
+        self.search_var = tk.StringVar()
+        self.entry = ttk.Entry(self, textvariable=self.search_var, font=('Helvetica', 10))
+        self.entry.grid(row=0, column=0, columnspan=2, sticky='ew')
+        self.listbox = tk.Listbox(self, height=5, exportselection=False, font=('Helvetica', 10))
+        self.listbox.grid(row=1, column=0, sticky='ew', pady=(4, 0))
+        scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.listbox.yview)
+        scrollbar.grid(row=1, column=1, sticky='ns', pady=(4, 0))
+        self.listbox.config(yscrollcommand=scrollbar.set)
+        self.count_label = ttk.Label(self, text="", font=('Helvetica', 9, 'italic'))
+        self.count_label.grid(row=2, column=0, columnspan=2, sticky='w')
+
+        self.search_var.trace_add('write', lambda *args: self._refresh())
+        self.entry.bind('<Return>', self._select_first)
+        self.entry.bind('<Down>', lambda event: self.listbox.focus_set())
+        self.listbox.bind('<<ListboxSelect>>', self._on_listbox_select)
+        self.set_state("disabled")
+
+    def set_patients(self, patient_ids):
+        """Reconstruye el índice con los IDs de una nueva cohorte."""
+        self.index = PatientIndex(patient_ids)
+        self.selected_id = None
+        self._refresh()
+
+    def position(self, patient_id):
+        return self.index.position(patient_id)
+
+    def clear(self):
+        self.selected_id = None
+        self.search_var.set('')
+
+    def set_state(self, state):
+        """'normal' o 'disabled' ('readonly' equivale a 'normal')."""
+        state = "disabled" if state == "disabled" else "normal"
+        self.entry.config(state=state)
+        self.listbox.config(state=state)
+
+    def _refresh(self):
+        matches, total = self.index.search(self.search_var.get(), self.max_results)
+        listbox_state = self.listbox.cget('state')
+        self.listbox.config(state="normal")
+        self.listbox.delete(0, tk.END)
+        if matches:
+            self.listbox.insert(tk.END, *matches)
+        if self.selected_id in matches:
+            self.listbox.selection_set(matches.index(self.selected_id))
+        self.listbox.config(state=listbox_state)
+
+        if not len(self.index):
+            text = ""
+        elif total > len(matches):
+            text = f"{total} coincidencias (se muestran las primeras {len(matches)}; escriba más para acotar)"
+        else:
+            text = f"{total} coincidencias"
+        self.count_label.config(text=text)
+
+    def _select_first(self, event=None):
+        if self.listbox.size():
+            self.listbox.selection_clear(0, tk.END)
+            self.listbox.selection_set(0)
+            self._on_listbox_select()
+
+    def _on_listbox_select(self, event=None):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        self.selected_id = self.listbox.get(selection[0])
+        self.on_select(self.selected_id)
@@ -0,0 +1,82 @@
+# patient_store.py
+# Almacén de datos de pacientes en SQLite, con una fila por N° Historia.
+# Sustituye a reescribir 'patient_data.json' entero en cada guardado: cada
+# lectura o escritura toca solo un paciente y SQLite garantiza que un fallo a
+# mitad de escritura no corrompa el archivo. El modo WAL permite que varios
+# hilos o procesos (ej: los del lote) lean y escriban a la vez.
+
+import os
+import json
+import sqlite3
+import threading
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patient_data.sqlite3")
+LEGACY_JSON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patient_data.json")
+
+
+class PatientStore:
+    """
+    Diccionario persistente {N° Historia: datos del paciente}.
+    La base de datos se abre en el primer uso (una conexión por hilo). Si se
+    crea por primera vez y existe el JSON antiguo, sus pacientes se importan.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, legacy_json_path=LEGACY_JSON_PATH, timeout=10.0):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._init_lock:
+                is_new = not os.path.exists(self.db_path)
+                conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                if not self._initialized:
+                    with conn:
+                        conn.execute("CREATE TABLE IF NOT EXISTS pacientes (id TEXT PRIMARY KEY, datos TEXT NOT NULL)")
+                    if is_new:
+                        self._import_legacy_json(conn)
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy_json(self, conn):
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        with open(self.legacy_json_path, 'r') as f:
+            legacy_db = json.load(f)
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO pacientes (id, datos) VALUES (?, ?)",
+                ((patient_id, json.dumps(info)) for patient_id, info in legacy_db.items())
+            )
+
+    def get(self, patient_id, default=None):
+        row = self._connection().execute("SELECT datos FROM pacientes WHERE id = ?", (patient_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __contains__(self, patient_id):
+        return self._connection().execute("SELECT 1 FROM pacientes WHERE id = ?", (patient_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM pacientes").fetchone()[0]
+
+    def save(self, patient_info):
+        """Inserta o actualiza un paciente (clave: 'N° Historia'). Devuelve False si no tiene N° Historia."""
+        patient_id = patient_info.get("N° Historia")
+        if not patient_id:
+            return False
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO pacientes (id, datos) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET datos = excluded.datos",
+                (patient_id, json.dumps(patient_info))
+            )
+        return True
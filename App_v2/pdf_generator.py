@@ -1,6 +1,7 @@
 # pdf_generator.py
 
 import os
+from collections import OrderedDict
 from datetime import datetime
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -9,117 +10,260 @@ from reportlab.platypus import Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 
-def create_pdf_report(patient_info, genotypes, phenotypes, recommendations, folder=""):
-    """Generates the final PDF report with hyperlinks and bold keywords."""
-    try:
-        if folder:
-            os.makedirs(folder, exist_ok=True)
-            filename = os.path.join(folder, f"Informe_PGx_{patient_info['N° Historia']}_{datetime.now().strftime('%Y%m%d')}.pdf")
-        else:
-            filename = f"Informe_PGx_{patient_info['N° Historia']}_{datetime.now().strftime('%Y%m%d')}.pdf"
+from instrumentation import medir
 
-        c = canvas.Canvas(filename, pagesize=A4)
-        width, height = A4
-
-        c.setFont("Helvetica-Bold", 16)
-        c.drawCentredString(width / 2.0, height - 3*cm, "INFORME FARMACOGENÉTICO - PERFIL ONCOLOGÍA")
-        
-        text_y = height - 4.5*cm
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(2*cm, text_y, "PACIENTE:")
-        c.drawString(11*cm, text_y, "N° HISTORIA:")
-        c.setFont("Helvetica", 11)
-        c.drawString(4.5*cm, text_y, f"{patient_info.get('Nombre', '')} {patient_info.get('Apellidos', '')}")
-        c.drawString(14*cm, text_y, patient_info.get('N° Historia', ''))
-
-        text_y -= 0.7*cm
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(2*cm, text_y, "FECHA DE NACIMIENTO:")
-        c.drawString(11*cm, text_y, "SEXO:")
-        c.setFont("Helvetica", 11)
-        c.drawString(6.5*cm, text_y, patient_info.get('Fecha de Nacimiento', ''))
-        c.drawString(12.5*cm, text_y, patient_info.get('Sexo', ''))
-        
-        text_y -= 1*cm
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(2*cm, text_y, "ENFERMEDADES ACTUALES:")
-        text_y -= 0.6*cm
-        text_object = c.beginText(2*cm, text_y)
-        text_object.setFont("Helvetica", 10)
-        for line in patient_info.get('Enfermedades', '').split('\n'):
-            text_object.textLine(line)
-        c.drawText(text_object)
-        
-        text_y -= (len(patient_info.get('Enfermedades', '').split('\n')) * 0.4 + 0.8) * cm
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(2*cm, text_y, "TRATAMIENTO HABITUAL:")
-        text_y -= 0.6*cm
-        text_object = c.beginText(2*cm, text_y)
-        text_object.setFont("Helvetica", 10)
-        for line in patient_info.get('Tratamiento', '').split('\n'):
-            text_object.textLine(line)
-        c.drawText(text_object)
-        
-        table_top_y = text_y - (len(patient_info.get('Tratamiento', '').split('\n')) * 0.4 + 1.2) * cm
-
-        c.line(2*cm, table_top_y, width - 2*cm, table_top_y)
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(2*cm, table_top_y - 0.7*cm, "RESULTADOS")
-
-        # Define URLs for hyperlinks
-        GUIDELINE_URLS = {
-            "DPYD": "https://www.clinpgx.org/chemical/PA128406956/guidelineAnnotation/PA166122686",
-            "CYP2D6": "https://www.clinpgx.org/chemical/PA451581/guidelineAnnotation/PA166176068",
-            "UGT1A1": "https://www.clinpgx.org/chemical/PA450085/guidelineAnnotation/PA166104951"
-        }
+GENES = ['DPYD', 'CYP2D6', 'UGT1A1']
+
+# Bump whenever the report layout or its static text changes: batch runs in
+# incremental mode then regenerate every report instead of skipping it.
+TEMPLATE_VERSION = 1
+
+# Define URLs for hyperlinks
+GUIDELINE_URLS = {
+    "DPYD": "https://www.clinpgx.org/chemical/PA128406956/guidelineAnnotation/PA166122686",
+    "CYP2D6": "https://www.clinpgx.org/chemical/PA451581/guidelineAnnotation/PA166176068",
+    "UGT1A1": "https://www.clinpgx.org/chemical/PA450085/guidelineAnnotation/PA166104951"
+}
+
+DRUGS = {
+    "DPYD": 'Fluorouracilo,<br/>Capecitabina,<br/>Tegafur',
+    "CYP2D6": 'Tamoxifeno',
+    "UGT1A1": 'Irinotecan'
+}
+
+
+class ReportTemplate:
+    """
+    Everything in the report that does not depend on the patient: styles,
+    table header, gene/drug cells, table style and the static page chrome
+    (title, field labels and CPIC footer). Build it once per batch and pass it
+    to every create_pdf_report call.
+    """
+    FORM_NAME = "PGxPageChrome"
+    COL_WIDTHS = [1.8*cm, 2.7*cm, 3.5*cm, 3.5*cm, 5.5*cm]
+    TABLE_CACHE_SIZE = 256
+
+    def __init__(self):
+        self.width, self.height = A4
 
         styles = getSampleStyleSheet()
-        cell_style = ParagraphStyle('cell_style', parent=styles['Normal'], fontSize=9, leading=12)
-        link_style = ParagraphStyle('link_style', parent=cell_style, textColor=colors.blue, fontName='Helvetica-Bold')
-        header_style = ParagraphStyle('header_style', parent=styles['Normal'], fontSize=10, textColor=colors.whitesmoke, fontName='Helvetica-Bold', alignment=1)
-        
-        data = [
-            [Paragraph(col, header_style) for col in ['Gen', 'Genotipo', 'Fenotipo', 'Fármaco', 'Recomendación']],
-            [
-                Paragraph(f'<link href="{GUIDELINE_URLS["DPYD"]}" color="blue"><u>DPYD</u></link>', cell_style),
-                Paragraph(genotypes.get('DPYD', 'N/A'), cell_style),
-                Paragraph(phenotypes.get('DPYD', 'N/A'), cell_style),
-                Paragraph('Fluorouracilo,<br/>Capecitabina,<br/>Tegafur', cell_style),
-                Paragraph(recommendations.get('DPYD', ''), cell_style)
-            ],
-            [
-                Paragraph(f'<link href="{GUIDELINE_URLS["CYP2D6"]}" color="blue"><u>CYP2D6</u></link>', cell_style),
-                Paragraph(genotypes.get('CYP2D6', 'N/A'), cell_style),
-                Paragraph(phenotypes.get('CYP2D6', 'N/A'), cell_style),
-                Paragraph('Tamoxifeno', cell_style),
-                Paragraph(recommendations.get('CYP2D6', ''), cell_style)
-            ],
-            [
-                Paragraph(f'<link href="{GUIDELINE_URLS["UGT1A1"]}" color="blue"><u>UGT1A1</u></link>', cell_style),
-                Paragraph(genotypes.get('UGT1A1', 'N/A'), cell_style),
-                Paragraph(phenotypes.get('UGT1A1', 'N/A'), cell_style),
-                Paragraph('Irinotecan', cell_style),
-                Paragraph(recommendations.get('UGT1A1', ''), cell_style)
-            ]
-        ]
-
-        table = Table(data, colWidths=[1.8*cm, 2.7*cm, 3.5*cm, 3.5*cm, 5.5*cm])
-        table.setStyle(TableStyle([
+        self.cell_style = ParagraphStyle('cell_style', parent=styles['Normal'], fontSize=9, leading=12)
+        self.link_style = ParagraphStyle('link_style', parent=self.cell_style, textColor=colors.blue, fontName='Helvetica-Bold')
+        self.header_style = ParagraphStyle('header_style', parent=styles['Normal'], fontSize=10, textColor=colors.whitesmoke, fontName='Helvetica-Bold', alignment=1)
+
+        self.header_row = [Paragraph(col, self.header_style) for col in ['Gen', 'Genotipo', 'Fenotipo', 'Fármaco', 'Recomendación']]
+        self.gene_cells = {
+            gene: Paragraph(f'<link href="{GUIDELINE_URLS[gene]}" color="blue"><u>{gene}</u></link>', self.cell_style)
+            for gene in GENES
+        }
+        self.drug_cells = {gene: Paragraph(DRUGS[gene], self.cell_style) for gene in GENES}
+
+        self.table_style = TableStyle([
             ('BACKGROUND', (0,0), (-1,0), colors.grey),
             ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
             ('GRID', (0,0), (-1,-1), 1, colors.black),
             ('TOPPADDING', (0,0), (-1,-1), 6),
             ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-        ]))
-        
-        table_width, table_height = table.wrapOn(c, width, height)
-        table_y = table_top_y - 1*cm - table_height
-        table.drawOn(c, 2*cm, table_y)
+        ])
+
+        # (genotype, phenotype, recommendation) per gene -> (wrapped table, height)
+        self._table_cache = OrderedDict()
+        self.table_cache_hits = 0
+        self.table_cache_misses = 0
+
+    def draw_page_chrome(self, c):
+        """Draws the static part of the page. It is stored as a form XObject the first time it is used in a document."""
+        if not c.hasForm(self.FORM_NAME):
+            c.beginForm(self.FORM_NAME)
+            width, height = self.width, self.height
+
+            c.setFont("Helvetica-Bold", 16)
+            c.drawCentredString(width / 2.0, height - 3*cm, "INFORME FARMACOGENÉTICO - PERFIL ONCOLOGÍA")
+
+            text_y = height - 4.5*cm
+            c.setFont("Helvetica-Bold", 11)
+            c.drawString(2*cm, text_y, "PACIENTE:")
+            c.drawString(11*cm, text_y, "N° HISTORIA:")
+            text_y -= 0.7*cm
+            c.drawString(2*cm, text_y, "FECHA DE NACIMIENTO:")
+            c.drawString(11*cm, text_y, "SEXO:")
+            text_y -= 1*cm
+            c.drawString(2*cm, text_y, "ENFERMEDADES ACTUALES:")
+
+            c.setFont("Helvetica-Oblique", 8)
+            c.drawString(2*cm, 3*cm, "Este informe ha sido elaborado de acuerdo a las guías clínicas del Consorcio para la Implementación de la Farmacogenética Clínica (CPIC).")
+            c.endForm()
+        c.doForm(self.FORM_NAME)
+
+    def build_results_table(self, genotypes, phenotypes, recommendations):
+        data = [self.header_row]
+        for gene in GENES:
+            data.append([
+                self.gene_cells[gene],
+                Paragraph(genotypes.get(gene, 'N/A'), self.cell_style),
+                Paragraph(phenotypes.get(gene, 'N/A'), self.cell_style),
+                self.drug_cells[gene],
+                Paragraph(recommendations.get(gene, ''), self.cell_style)
+            ])
+        table = Table(data, colWidths=self.COL_WIDTHS)
+        table.setStyle(self.table_style)
+        return table
+
+    def get_results_table(self, c, genotypes, phenotypes, recommendations):
+        """
+        Returns (table, height) with the table already wrapped. Most patients share
+        one of a few result combinations, so tables are cached (LRU) by their content
+        and reused without re-parsing the markup or re-running the layout.
+        """
+        key = tuple(
+            (genotypes.get(gene, 'N/A'), phenotypes.get(gene, 'N/A'), recommendations.get(gene, ''))
+            for gene in GENES
+        )
+        cached = self._table_cache.get(key)
+        if cached is not None:
+            self._table_cache.move_to_end(key)
+            self.table_cache_hits += 1
+            return cached
+
+        self.table_cache_misses += 1
+        table = self.build_results_table(genotypes, phenotypes, recommendations)
+        table_width, table_height = table.wrapOn(c, self.width, self.height)
+        self._table_cache[key] = (table, table_height)
+        if len(self._table_cache) > self.TABLE_CACHE_SIZE:
+            self._table_cache.popitem(last=False)
+        return table, table_height
+
+
+_default_template = None
+
+def get_default_template():
+    """Returns the ReportTemplate shared by every report of this process."""
+    global _default_template
+    if _default_template is None:
+        _default_template = ReportTemplate()
+    return _default_template
+
 
-        c.setFont("Helvetica-Oblique", 8)
-        c.drawString(2*cm, 3*cm, "Este informe ha sido elaborado de acuerdo a las guías clínicas del Consorcio para la Implementación de la Farmacogenética Clínica (CPIC).")
+def draw_report(c, template, patient_info, genotypes, phenotypes, recommendations):
+    """Draws one patient's report on the current page of canvas 'c'."""
+    width, height = template.width, template.height
+    # The table is prepared first so that bad data fails before anything is drawn
+    table, table_height = template.get_results_table(c, genotypes, phenotypes, recommendations)
+    template.draw_page_chrome(c)
 
-        c.save()
+    text_y = height - 4.5*cm
+    c.setFont("Helvetica", 11)
+    c.drawString(4.5*cm, text_y, f"{patient_info.get('Nombre', '')} {patient_info.get('Apellidos', '')}")
+    c.drawString(14*cm, text_y, patient_info.get('N° Historia', ''))
+
+    text_y -= 0.7*cm
+    c.drawString(6.5*cm, text_y, patient_info.get('Fecha de Nacimiento', ''))
+    c.drawString(12.5*cm, text_y, patient_info.get('Sexo', ''))
+
+    text_y -= 1*cm
+    text_y -= 0.6*cm
+    text_object = c.beginText(2*cm, text_y)
+    text_object.setFont("Helvetica", 10)
+    for line in patient_info.get('Enfermedades', '').split('\n'):
+        text_object.textLine(line)
+    c.drawText(text_object)
+
+    text_y -= (len(patient_info.get('Enfermedades', '').split('\n')) * 0.4 + 0.8) * cm
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(2*cm, text_y, "TRATAMIENTO HABITUAL:")
+    text_y -= 0.6*cm
+    text_object = c.beginText(2*cm, text_y)
+    text_object.setFont("Helvetica", 10)
+    for line in patient_info.get('Tratamiento', '').split('\n'):
+        text_object.textLine(line)
+    c.drawText(text_object)
+
+    table_top_y = text_y - (len(patient_info.get('Tratamiento', '').split('\n')) * 0.4 + 1.2) * cm
+
+    c.line(2*cm, table_top_y, width - 2*cm, table_top_y)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(2*cm, table_top_y - 0.7*cm, "RESULTADOS")
+
+    table_y = table_top_y - 1*cm - table_height
+    table.drawOn(c, 2*cm, table_y)
+
+
+def create_pdf_bundle(reports, filename, template=None):
+    """
+    Renders many reports as consecutive pages of a single PDF.
+    'reports' yields (patient_info, genotypes, phenotypes, recommendations).
+    Each patient gets a PDF bookmark. Returns (index, error), where index is a
+    list of {"patient_id", "first_page", "last_page"} (or {"patient_id", "error"}
+    for reports that could not be drawn).
+    """
+    try:
+        if template is None:
+            template = get_default_template()
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        c = canvas.Canvas(filename, pagesize=A4)
+        index = []
+        for patient_info, genotypes, phenotypes, recommendations in reports:
+            patient_id = patient_info.get('N° Historia', '')
+            first_page = c.getPageNumber()
+            try:
+                with medir('pdf.maquetacion', filas=1):
+                    draw_report(c, template, patient_info, genotypes, phenotypes, recommendations)
+                c.bookmarkPage(f"p{first_page}")
+                c.addOutlineEntry(str(patient_id), f"p{first_page}", level=0)
+                index.append({"patient_id": patient_id, "first_page": first_page, "last_page": c.getPageNumber()})
+            except Exception as e:
+                index.append({"patient_id": patient_id, "error": str(e)})
+            c.showPage()
+        with medir('pdf.guardado') as medicion:
+            c.save()
+            medicion.bytes = os.path.getsize(filename)
+        return index, None
+    except Exception as e:
+        return None, str(e)
+
+
+def report_filename(patient_info):
+    """File name of a patient's report, without folder."""
+    return f"Informe_PGx_{patient_info['N° Historia']}_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+
+def render_pdf_report(patient_info, genotypes, phenotypes, recommendations, template=None):
+    """
+    Renders a patient's report in memory, without touching the disk.
+    Returns (filename, pdf_bytes, error); filename has no folder.
+    """
+    try:
+        filename = report_filename(patient_info)
+        if template is None:
+            template = get_default_template()
+
+        with medir('pdf.maquetacion', filas=1):
+            c = canvas.Canvas(filename, pagesize=A4)
+            draw_report(c, template, patient_info, genotypes, phenotypes, recommendations)
+        with medir('pdf.serializacion', filas=1) as medicion:
+            data = c.getpdfdata()
+            medicion.bytes = len(data)
+        return filename, data, None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def create_pdf_report(patient_info, genotypes, phenotypes, recommendations, folder="", template=None):
+    """Generates the final PDF report with hyperlinks and bold keywords."""
+    filename, data, error = render_pdf_report(patient_info, genotypes, phenotypes, recommendations, template)
+    if error:
+        return None, error
+    try:
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            filename = os.path.join(folder, filename)
+        with medir('pdf.guardado', filas=1) as medicion:
+            with open(filename, 'wb') as f:
+                f.write(data)
+            medicion.bytes = len(data)
         return filename, None
     except Exception as e:
-        return None, str(e)
\ No newline at end of file
+        return None, str(e)
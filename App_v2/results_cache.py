@@ -0,0 +1,296 @@
+# results_cache.py
+# Caché persistente (SQLite) de resultados por muestra.
+# La clave de cada muestra es un hash de sus llamadas crudas (y de los nombres
+# de columna), mezclado con la versión de las reglas de alelos, la de la tabla
+# de fenotipos CYP2D6 y VERSION_RESULTADOS. Al cargar un CSV que se solapa con
+# análisis anteriores solo se analizan las muestras nuevas o modificadas, y la
+# última cohorte analizada se puede recuperar al reiniciar la aplicación.
+
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from logic_engine import run_full_analysis, cargar_reglas, compactar_resultados, COLUMNAS_RESULTADOS
+from instrumentation import medir
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados_cache.sqlite3")
+
+# Subir este número cuando cambie la lógica del análisis (no las reglas ni la
+# tabla CYP2D6, que ya tienen su propia versión): invalida toda la caché.
+VERSION_RESULTADOS = 2
+
+_TAMANO_CONSULTA = 50000
+_versiones_mapas = {}  # id(mapa) -> (mapa, version)
+
+
+def version_mapa_cyp2d6(mapa):
+    """sha256 del contenido del mapa de fenotipos CYP2D6 (calculado una vez por objeto)."""
+    guardado = _versiones_mapas.get(id(mapa))
+    if guardado is not None and guardado[0] is mapa:
+        return guardado[1]
+    texto = json.dumps(sorted(mapa.items()), ensure_ascii=False)
+    version = hashlib.sha256(texto.encode('utf-8')).hexdigest()
+    _versiones_mapas[id(mapa)] = (mapa, version)
+    return version
+
+
+def calcular_claves(df_genotipos_raw, semilla):
+    """
+    Devuelve una matriz (n_muestras, 2) de int64: dos hashes de 64 bits por
+    fila (128 bits en total) de las llamadas crudas, en el orden de las filas.
+    'semilla' mezcla las versiones y los nombres de columna en ambos hashes.
+    """
+    resumen = hashlib.sha256(
+        json.dumps([semilla, [str(c) for c in df_genotipos_raw.columns]]).encode('utf-8')
+    ).hexdigest()
+    claves = np.empty((len(df_genotipos_raw), 2), dtype=np.int64)
+    for i, hash_key in enumerate((resumen[:16], resumen[16:32])):
+        hashes = pd.util.hash_pandas_object(df_genotipos_raw, index=False, hash_key=hash_key)
+        claves[:, i] = hashes.to_numpy(dtype=np.uint64).view(np.int64)
+    return claves
+
+
+class CacheResultados:
+    """
+    Resultados ya calculados, indexados por la clave de las llamadas de cada
+    muestra. Además guarda la última cohorte (muestras en orden y su clave)
+    para restaurarla al arrancar. Una conexión por hilo, como 'PatientStore'.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, timeout=10.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self.reutilizadas = 0
+        self.analizadas = 0
+        self._contadores_lock = threading.Lock()
+        self._grabando_cohorte = False
+        self._meta_cohorte_nueva = None
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._init_lock:
+                conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                if not self._initialized:
+                    columnas = ", ".join(f"{c} TEXT" for c in COLUMNAS_RESULTADOS)
+                    with conn:
+                        conn.execute(
+                            f"CREATE TABLE IF NOT EXISTS resultados (h1 INTEGER, h2 INTEGER, {columnas}, "
+                            "PRIMARY KEY (h1, h2)) WITHOUT ROWID"
+                        )
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS cohorte "
+                            "(posicion INTEGER PRIMARY KEY, muestra TEXT, h1 INTEGER, h2 INTEGER)"
+                        )
+                        # Cohorte en curso: sustituye a 'cohorte' solo al finalizar
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS cohorte_nueva "
+                            "(posicion INTEGER PRIMARY KEY, muestra TEXT, h1 INTEGER, h2 INTEGER)"
+                        )
+                        conn.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def semilla(reglas, cyp2d6_phenotype_map):
+        """Todo lo que, además de las llamadas, determina el resultado de una muestra."""
+        return f"{VERSION_RESULTADOS}:{reglas.version}:{version_mapa_cyp2d6(cyp2d6_phenotype_map)}"
+
+    def buscar(self, claves):
+        """
+        Devuelve un DataFrame con los resultados guardados para las claves
+        (matriz n x 2) que estén en la caché, indexado por (h1, h2).
+        """
+        conn = self._connection()
+        encontrados = []
+        with conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS consulta (h1 INTEGER, h2 INTEGER)")
+            for inicio in range(0, len(claves), _TAMANO_CONSULTA):
+                conn.execute("DELETE FROM consulta")
+                conn.executemany("INSERT INTO consulta VALUES (?, ?)", claves[inicio:inicio + _TAMANO_CONSULTA].tolist())
+                encontrados.extend(conn.execute(
+                    "SELECT r.* FROM consulta c JOIN resultados r ON r.h1 = c.h1 AND r.h2 = c.h2"
+                ).fetchall())
+        df = pd.DataFrame(encontrados, columns=['h1', 'h2'] + COLUMNAS_RESULTADOS)
+        return df.set_index(['h1', 'h2'])
+
+    def guardar(self, claves, df_resultados):
+        """Guarda los resultados de 'df_resultados' (misma fila que 'claves')."""
+        filas = (
+            (int(h1), int(h2), *valores)
+            for (h1, h2), valores in zip(claves, df_resultados[COLUMNAS_RESULTADOS].itertuples(index=False, name=None))
+        )
+        marcadores = ", ".join("?" * (len(COLUMNAS_RESULTADOS) + 2))
+        conn = self._connection()
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO resultados VALUES ({marcadores})", filas)
+
+    def claves(self, df_genotipos_raw, cyp2d6_phenotype_map):
+        """Claves (matriz n x 2) de las filas de 'df_genotipos_raw' con las reglas y la tabla actuales."""
+        return calcular_claves(df_genotipos_raw, self.semilla(cargar_reglas(), cyp2d6_phenotype_map))
+
+    def analizar(self, df_genotipos_raw, cyp2d6_phenotype_map, cache_diplotipos=None, claves=None, funcion_analisis=None):
+        """
+        Igual que 'run_full_analysis', pero solo analiza las muestras cuya
+        clave no está en la caché; el resto se copian de la caché.
+        Entre 'iniciar_cohorte' y 'finalizar_cohorte' las muestras se añaden
+        además a la cohorte guardada. 'claves' permite pasar las ya calculadas
+        con 'claves()' y 'funcion_analisis(df) -> (df, error)' sustituye a
+        'run_full_analysis' para las muestras pendientes (ej: para enviarlas
+        a otro proceso). Se puede llamar desde varios hilos. Devuelve (df, error).
+        """
+        if funcion_analisis is None:
+            funcion_analisis = lambda df: run_full_analysis(df, cyp2d6_phenotype_map, cache_diplotipos=cache_diplotipos)
+        if claves is None:
+            try:
+                semilla = self.semilla(cargar_reglas(), cyp2d6_phenotype_map)
+            except Exception:
+                # Sin reglas válidas no hay clave: 'run_full_analysis' devuelve el error
+                return funcion_analisis(df_genotipos_raw)
+
+        with medir('cache_resultados.buscar', filas=len(df_genotipos_raw)):
+            if claves is None:
+                claves = calcular_claves(df_genotipos_raw, semilla)
+            claves_unicas, posiciones = np.unique(claves, axis=0, return_inverse=True)
+            posiciones = posiciones.reshape(-1)
+            guardados = self.buscar(claves_unicas)
+
+        indice_unicas = pd.MultiIndex.from_arrays([claves_unicas[:, 0], claves_unicas[:, 1]])
+        en_cache = indice_unicas.isin(guardados.index)
+        pendientes = ~en_cache[posiciones]
+
+        if pendientes.any():
+            # Una fila por clave nueva basta: las repetidas comparten resultado
+            filas_nuevas = np.flatnonzero(pendientes)
+            _, primera = np.unique(posiciones[filas_nuevas], return_index=True)
+            filas_nuevas = filas_nuevas[primera]
+            df_nuevos, error = funcion_analisis(df_genotipos_raw.iloc[filas_nuevas])
+            if error:
+                return None, error
+            with medir('cache_resultados.guardar', filas=len(df_nuevos)):
+                self.guardar(claves[filas_nuevas], df_nuevos)
+            nuevos = df_nuevos.set_axis(
+                pd.MultiIndex.from_arrays([claves[filas_nuevas, 0], claves[filas_nuevas, 1]], names=['h1', 'h2'])
+            )
+            guardados = pd.concat([guardados, nuevos[COLUMNAS_RESULTADOS]])
+            diplotipos = df_nuevos.attrs.get('cache_diplotipos')
+        else:
+            diplotipos = cache_diplotipos.resumen() if cache_diplotipos is not None else {}
+
+        # Reordena los resultados como las filas de entrada (categorizando
+        # primero las claves únicas, no cada fila)
+        filas = guardados.index.get_indexer(indice_unicas)
+        df_resultados = compactar_resultados(guardados.iloc[filas]).iloc[posiciones].set_axis(df_genotipos_raw.index)
+
+        n_nuevas = int(pendientes.sum())
+        with self._contadores_lock:
+            self.analizadas += n_nuevas
+            self.reutilizadas += len(df_resultados) - n_nuevas
+        if self._grabando_cohorte:
+            self._anadir_a_cohorte(df_resultados.index, claves)
+        df_resultados.attrs['cache_diplotipos'] = diplotipos
+        df_resultados.attrs['cache_resultados'] = self.resumen()
+        return df_resultados, None
+
+    def resumen(self):
+        return {'reutilizadas': self.reutilizadas, 'analizadas': self.analizadas}
+
+    # --- Última cohorte ---
+
+    def reiniciar_contadores(self):
+        with self._contadores_lock:
+            self.reutilizadas = self.analizadas = 0
+
+    def iniciar_cohorte(self, nombre_archivo, cyp2d6_phenotype_map):
+        """
+        Empieza una cohorte nueva: las llamadas a 'analizar' la van llenando
+        aparte y la cohorte guardada no cambia hasta 'finalizar_cohorte'. Si
+        el análisis falla o se cancela, 'descartar_cohorte' deja la anterior.
+        """
+        self.reiniciar_contadores()
+        meta = [('archivo', nombre_archivo), ('semilla', self.semilla(cargar_reglas(), cyp2d6_phenotype_map))]
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cohorte_nueva")
+        self._meta_cohorte_nueva = meta
+        self._grabando_cohorte = True
+
+    def _sustituir_meta(self, conn, meta):
+        conn.execute("DELETE FROM meta")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", meta + [('completa', '1')])
+
+    def grabar_cohorte(self, nombre_archivo, cyp2d6_phenotype_map, muestras, claves):
+        """
+        Sustituye la cohorte guardada por 'muestras' (en ese orden, con sus
+        claves) en una sola transacción y la marca como completa. Lo usa la
+        carga de varios archivos, que analiza cada uno en su propio hilo.
+        """
+        meta = [('archivo', nombre_archivo), ('semilla', self.semilla(cargar_reglas(), cyp2d6_phenotype_map))]
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cohorte")
+            conn.executemany(
+                "INSERT INTO cohorte (muestra, h1, h2) VALUES (?, ?, ?)",
+                ((muestra, int(h1), int(h2)) for muestra, (h1, h2) in zip(muestras, claves))
+            )
+            self._sustituir_meta(conn, meta)
+
+    def _anadir_a_cohorte(self, muestras, claves):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO cohorte_nueva (muestra, h1, h2) VALUES (?, ?, ?)",
+                ((muestra, int(h1), int(h2)) for muestra, (h1, h2) in zip(muestras, claves))
+            )
+
+    def finalizar_cohorte(self):
+        """Sustituye la cohorte guardada por la nueva en una sola transacción: solo entonces se restaurará al arrancar."""
+        self._grabando_cohorte = False
+        meta, self._meta_cohorte_nueva = self._meta_cohorte_nueva, None
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cohorte")
+            conn.execute(
+                "INSERT INTO cohorte (muestra, h1, h2) SELECT muestra, h1, h2 FROM cohorte_nueva ORDER BY posicion"
+            )
+            conn.execute("DELETE FROM cohorte_nueva")
+            self._sustituir_meta(conn, meta)
+
+    def descartar_cohorte(self):
+        """Abandona la cohorte en curso (análisis fallido o cancelado); la guardada no cambia."""
+        self._grabando_cohorte = False
+        self._meta_cohorte_nueva = None
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cohorte_nueva")
+
+    def cargar_cohorte(self, cyp2d6_phenotype_map):
+        """
+        Devuelve (results_df, nombre_archivo) de la última cohorte completa, o
+        (None, None) si no la hay o si las reglas o la tabla CYP2D6 han cambiado
+        desde entonces (sus resultados ya no serían válidos).
+        """
+        conn = self._connection()
+        meta = dict(conn.execute("SELECT clave, valor FROM meta").fetchall())
+        if meta.get('completa') != '1':
+            return None, None
+        if meta.get('semilla') != self.semilla(cargar_reglas(), cyp2d6_phenotype_map):
+            return None, None
+        columnas = ", ".join(f"r.{c}" for c in COLUMNAS_RESULTADOS)
+        df = pd.read_sql_query(
+            f"SELECT c.muestra AS 'Sample/Assay', {columnas} FROM cohorte c "
+            "JOIN resultados r ON r.h1 = c.h1 AND r.h2 = c.h2 ORDER BY c.posicion",
+            conn, index_col='Sample/Assay'
+        )
+        return compactar_resultados(df), meta.get('archivo')
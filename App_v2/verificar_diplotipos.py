@@ -0,0 +1,108 @@
+# verificar_diplotipos.py
+# Comprueba que la resolución de diplotipos por tabla ('MotorDiplotipos', la
+# que usa 'CacheDiplotipos') da el mismo resultado que 'combinar_gen', la
+# lógica clínica original, para firmas de alelos aleatorias de cada gen:
+#   python verificar_diplotipos.py --firmas 60000 --semilla 0
+# Ejecutarlo tras cualquier cambio en REGLAS_DIPLOTIPOS, ALELOS_AL_FINAL,
+# 'combinar_gen' o 'reglas_alelos.json'. Devuelve 1 si hay diferencias.
+
+import argparse
+import sys
+
+import numpy as np
+
+from logic_engine import (
+    cargar_reglas, combinar_gen, CacheDiplotipos, MotorDiplotipos, ALELO_REFERENCIA, GENES_ANALIZADOS
+)
+
+MAX_DIFERENCIAS_MOSTRADAS = 10
+
+
+def tablas_de_columnas(reglas, columnas):
+    """
+    Tabla de códigos de cada columna con todos los genotipos posibles: el
+    de una sola llamada (ej: 'UND') y cada par ordenado de alelos de sus
+    reglas, incluida la referencia.
+    """
+    tablas = []
+    for columna in columnas:
+        alelos = [ALELO_REFERENCIA] + sorted(set(reglas.mapa[columna].values()) - {ALELO_REFERENCIA})
+        tablas.append([(ALELO_REFERENCIA,)] + [(a, b) for a in alelos for b in alelos])
+    return tablas
+
+
+def firmas_aleatorias(tablas, n_firmas, generador, prob_variante=0.15):
+    """
+    Matriz (n_firmas, columnas) de códigos. Cada columna es '*1/*1' salvo con
+    probabilidad 'prob_variante', en cuyo caso se sortea cualquier genotipo:
+    así hay firmas con una, dos y varias variantes a la vez.
+    """
+    referencia = [tabla.index((ALELO_REFERENCIA, ALELO_REFERENCIA)) for tabla in tablas]
+    firmas = np.empty((n_firmas, len(tablas)), dtype=np.intp)
+    for j, tabla in enumerate(tablas):
+        variante = generador.random(n_firmas) < prob_variante
+        firmas[:, j] = np.where(variante, generador.integers(0, len(tabla), n_firmas), referencia[j])
+    return firmas
+
+
+def esperado(firmas, tablas, gen):
+    return [
+        combinar_gen([list(tablas[j][codigo]) for j, codigo in enumerate(fila)], gen)
+        for fila in firmas.tolist()
+    ]
+
+
+def comparar(nombre, firmas, tablas, gen, obtenido):
+    """Imprime y devuelve el número de firmas cuyo diplotipo difiere del de 'combinar_gen'."""
+    diferencias = [
+        (fila, e, o) for fila, e, o in zip(firmas.tolist(), esperado(firmas, tablas, gen), list(obtenido)) if e != o
+    ]
+    print(f"{nombre:<34} {len(firmas):>7} firmas  {len(diferencias):>5} diferencias")
+    for fila, e, o in diferencias[:MAX_DIFERENCIAS_MOSTRADAS]:
+        alelos = [tablas[j][codigo] for j, codigo in enumerate(fila)]
+        print(f"    {alelos}: combinar_gen={e!r}  motor={o!r}")
+    return len(diferencias)
+
+
+def verificar_gen(reglas, gen, n_firmas, generador):
+    columnas = [c for c in reglas.mapa if gen in c]
+    tablas = tablas_de_columnas(reglas, columnas)
+    firmas = firmas_aleatorias(tablas, n_firmas, generador)
+    diferencias = 0
+
+    motor = MotorDiplotipos(gen, tablas)
+    if motor.valido:
+        diferencias += comparar(f"{gen} (MotorDiplotipos)", firmas, tablas, gen, motor.resolver(firmas))
+    else:
+        print(f"{gen}: la tabla no es aplicable a estas reglas; solo se comprueba 'combinar_gen'")
+
+    # Camino completo de 'run_full_analysis' (columna categórica)
+    serie = CacheDiplotipos().combinar_codigos(list(firmas.T), tablas, gen, np.arange(len(firmas)))
+    diferencias += comparar(f"{gen} (CacheDiplotipos)", firmas, tablas, gen, serie.astype(str))
+
+    # Con un mismo alelo en dos columnas el motor no es válido y se usa 'combinar_gen'
+    tablas_repetidas = tablas + [tablas[0]]
+    firmas_repetidas = np.column_stack([firmas, firmas_aleatorias(tablas[:1], n_firmas, generador)])
+    if MotorDiplotipos(gen, tablas_repetidas).valido:
+        print(f"{gen}: se esperaba valido=False con una columna repetida")
+        diferencias += 1
+    serie = CacheDiplotipos().combinar_codigos(list(firmas_repetidas.T), tablas_repetidas, gen, np.arange(n_firmas))
+    diferencias += comparar(f"{gen} (valido=False)", firmas_repetidas, tablas_repetidas, gen, serie.astype(str))
+    return diferencias
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara MotorDiplotipos con combinar_gen en firmas aleatorias.")
+    parser.add_argument("--firmas", type=int, default=60000, help="Firmas aleatorias por gen.")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    reglas = cargar_reglas()
+    generador = np.random.default_rng(args.semilla)
+    diferencias = sum(verificar_gen(reglas, gen, args.firmas, generador) for gen in GENES_ANALIZADOS)
+    print("Sin diferencias." if not diferencias else f"{diferencias} diferencias en total.")
+    return 1 if diferencias else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())